@@ -8,32 +8,14 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from colorama import init, Fore, Style
 import re
+from datasets import list_available_files, read_transactions
+import session_cache
+import kernels
+from rollup import build_hourly_rollup, load_hourly_rollup, daily_rollup
+from stage_cache import cached_stage
 
 init()  # Khởi tạo colorama
 
-def list_available_files():
-    """Liệt kê các file dữ liệu có sẵn"""
-    files = [f for f in os.listdir('output') if f.startswith('transactions_')]
-    if not files:
-        print(f"\n{Fore.RED}Không tìm thấy file dữ liệu nào trong thư mục output!{Style.RESET_ALL}")
-        return None
-
-    print(f"\n{Fore.YELLOW}Danh sách file dữ liệu:{Style.RESET_ALL}")
-    for i, file in enumerate(files, 1):
-        file_path = os.path.join('output', file)
-        file_size = os.path.getsize(file_path) / (1024 * 1024)  # Convert to MB
-        print(f"{i}. {file} ({file_size:.1f} MB)")
-
-    while True:
-        try:
-            choice = input(f"\n{Fore.YELLOW}Chọn file để phân tích (1-{len(files)}): {Style.RESET_ALL}")
-            idx = int(choice) - 1
-            if 0 <= idx < len(files):
-                return files[idx].replace('transactions_', '').replace('.csv', '')
-        except ValueError:
-            pass
-        print(f"{Fore.RED}Lựa chọn không hợp lệ!{Style.RESET_ALL}")
-
 os.environ["LOKY_MAX_CPU_COUNT"] = "4"
 os.environ['JOBLIB_TEMP_FOLDER'] = os.path.expanduser('~')
 
@@ -57,57 +39,60 @@ def load_data(student_id):
     input_file = os.path.join('output', f'transactions_{student_id}.csv')
     print(f"File: {input_file}")
 
-    df = pd.read_csv(input_file,
-                    dtype={
-                        'customer_id': str,
-                        'price': float,
-                        'quantity': int,
-                        'discount': float
-                    },
-                    parse_dates=['order_date'])
+    def read():
+        # Dùng lại dữ liệu gốc nếu bước tiền xử lý đã đọc file trong phiên
+        df = session_cache.lookup(student_id, 'raw')
+        if df is None:
+            df = read_transactions(input_file)
+
+        # Chỉ lấy dữ liệu tốt (không có NaN)
+        df = df.dropna()
 
-    # Chỉ lấy dữ liệu tốt (không có NaN)
-    df = df.dropna()
+        # Tạo cột total_amount nếu chưa có
+        if 'total_amount' not in df.columns:
+            df['total_amount'] = kernels.total_amount(df['quantity'], df['price'], df['discount'])
+        return df
 
-    # Tạo cột total_amount nếu chưa có
-    if 'total_amount' not in df.columns:
-        df['total_amount'] = round(df['quantity'] * df['price'] * (1 - df['discount']), 2)
+    df = session_cache.cached_frame(student_id, 'clean', read)
 
     print(f"→ Đã đọc: {len(df):,} dòng")
     return df
 
-def create_daily_features(df):
+def create_daily_features(df, hourly=None):
     """Tạo đặc trưng theo ngày"""
-    print(f"\n{Fore.BLUE}[2/4] Tạo đặc trưng theo ngày{Style.RESET_ALL}")
-
-    # Thêm cột ngày
-    df['date'] = df['order_date'].dt.date
+    # Tổng hợp theo ngày từ bảng theo giờ thay vì quét lại dữ liệu gốc
+    if hourly is None:
+        hourly = build_hourly_rollup(df)
+    daily = daily_rollup(hourly)
 
     daily_features = pd.DataFrame()
 
     # 1. Tổng doanh thu
-    daily_features['total_revenue'] = df.groupby('date')['total_amount'].sum()
+    daily_features['total_revenue'] = daily['revenue']
 
     # 2. Số lượng đơn hàng
-    daily_features['total_orders'] = df.groupby('date').size()
+    daily_features['total_orders'] = daily['order_count']
 
     # 3. Giá trị đơn hàng trung bình
     daily_features['avg_order_value'] = daily_features['total_revenue'] / daily_features['total_orders']
 
     # 4. Tổng số sản phẩm bán được
-    daily_features['total_items'] = df.groupby('date')['quantity'].sum()
+    daily_features['total_items'] = daily['item_count']
 
     # 5. Tỷ lệ giảm giá trung bình
-    daily_features['avg_discount'] = df.groupby('date')['discount'].mean()
+    daily_features['avg_discount'] = daily['discount_sum'] / daily['order_count']
 
-    print("\nThống kê đặc trưng theo ngày:")
-    print(daily_features.describe().round(2).to_string())
     return daily_features
 
+def print_daily_features(features):
+    """In thống kê đặc trưng theo ngày"""
+    print(f"\n{Fore.BLUE}[2/4] Tạo đặc trưng theo ngày{Style.RESET_ALL}")
+
+    print("\nThống kê đặc trưng theo ngày:")
+    print(features.drop(columns='cluster', errors='ignore').describe().round(2).to_string())
+
 def cluster_daily_patterns(features, n_clusters=4):
     """Phân cụm mẫu hình ngày"""
-    print(f"\n{Fore.BLUE}[3/4] Phân cụm mẫu hình ngày{Style.RESET_ALL}")
-
     # Chuẩn hóa dữ liệu
     scaler = StandardScaler()
     features_scaled = scaler.fit_transform(features)
@@ -119,6 +104,12 @@ def cluster_daily_patterns(features, n_clusters=4):
     # Thêm nhãn cụm vào DataFrame
     features['cluster'] = clusters
 
+    return features, features_scaled
+
+def print_cluster_stats(features, n_clusters=4):
+    """In thống kê của từng cụm"""
+    print(f"\n{Fore.BLUE}[3/4] Phân cụm mẫu hình ngày{Style.RESET_ALL}")
+
     # Thống kê về các cụm
     print("\nThống kê theo cụm:")
     for i in range(n_clusters):
@@ -131,12 +122,8 @@ def cluster_daily_patterns(features, n_clusters=4):
         print(f"→ Số sản phẩm trung bình/ngày: {cluster_stats['total_items']:.0f}")
         print(f"→ Tỷ lệ giảm giá trung bình: {cluster_stats['avg_discount']:.2%}")
 
-    return features, features_scaled
-
 def visualize_clusters(features, features_scaled, student_id):
     """Tạo biểu đồ phân cụm"""
-    print(f"\n{Fore.BLUE}[4/4] Tạo biểu đồ phân cụm{Style.RESET_ALL}")
-
     # 1. Biểu đồ phân tán (Scatter plot)
     plt.figure(figsize=(15, 5), facecolor='white')
 
@@ -173,14 +160,27 @@ def visualize_clusters(features, features_scaled, student_id):
     # Lưu biểu đồ vào thư mục img
     output_file = os.path.join('img', f'daily_patterns_clusters_{student_id}.png')
     plt.savefig(output_file, dpi=300, bbox_inches='tight')
-    print(f"→ Đã lưu biểu đồ vào file: {output_file}")
+    plt.close()
 
-    # Lưu kết quả phân cụm
-    output_csv = os.path.join('output', f'daily_patterns_{student_id}.csv')
-    features.to_csv(output_csv)
-    print(f"→ Đã lưu kết quả phân cụm vào file: {output_csv}")
+def build_clusters(student_id, n_clusters=4):
+    """Tạo đặc trưng, phân cụm và vẽ biểu đồ; trả về đặc trưng kèm nội dung ảnh"""
+    # 1. Đọc dữ liệu (chỉ đọc file gốc khi bảng tổng hợp theo giờ chưa có hoặc đã cũ)
+    hourly = load_hourly_rollup(student_id, lambda: load_data(student_id))
+
+    # 2. Tạo đặc trưng theo ngày
+    features = create_daily_features(None, hourly)
+
+    # 3. Phân cụm
+    features, features_scaled = cluster_daily_patterns(features, n_clusters)
 
-def analyze_advanced(student_id=None):
+    # 4. Tạo biểu đồ
+    visualize_clusters(features, features_scaled, student_id)
+
+    with open(os.path.join('img', f'daily_patterns_clusters_{student_id}.png'), 'rb') as f:
+        image = f.read()
+    return features, image
+
+def analyze_advanced(student_id=None, n_clusters=4):
     print(f"\n{Fore.GREEN}Bắt đầu phân tích nâng cao...{Style.RESET_ALL}")
     print("=" * 50)
 
@@ -190,17 +190,25 @@ def analyze_advanced(student_id=None):
         if student_id is None:
             return None
 
-    # 1. Đọc dữ liệu
-    df = load_data(student_id)
+    # 1-4. Phân cụm và vẽ biểu đồ (dùng lại kết quả nếu file và tham số không đổi)
+    input_file = os.path.join('output', f'transactions_{student_id}.csv')
+    features, image = cached_stage('advanced', input_file, {'n_clusters': n_clusters},
+                                   lambda: build_clusters(student_id, n_clusters))
 
-    # 2. Tạo đặc trưng theo ngày
-    features = create_daily_features(df)
+    # In kết quả (cả khi tính mới lẫn khi dùng kết quả đã lưu)
+    print_daily_features(features)
+    print_cluster_stats(features, n_clusters)
 
-    # 3. Phân cụm
-    features, features_scaled = cluster_daily_patterns(features)
+    # Ghi lại biểu đồ và kết quả phân cụm tương ứng với tham số hiện tại
+    print(f"\n{Fore.BLUE}[4/4] Tạo biểu đồ phân cụm{Style.RESET_ALL}")
+    output_file = os.path.join('img', f'daily_patterns_clusters_{student_id}.png')
+    with open(output_file, 'wb') as f:
+        f.write(image)
+    print(f"→ Đã lưu biểu đồ vào file: {output_file}")
 
-    # 4. Tạo biểu đồ
-    visualize_clusters(features, features_scaled, student_id)
+    output_csv = os.path.join('output', f'daily_patterns_{student_id}.csv')
+    features.to_csv(output_csv)
+    print(f"→ Đã lưu kết quả phân cụm vào file: {output_csv}")
 
     print("\n" + "=" * 50)
     print(f"{Fore.GREEN}Hoàn thành phân tích nâng cao!{Style.RESET_ALL}")
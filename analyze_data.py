@@ -4,33 +4,18 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 from colorama import init, Fore, Style
+from datasets import list_available_files, read_transactions
+import session_cache
+import kernels
+from rollup import (build_hourly_rollup, load_hourly_rollup, weekly_rollup, weekly_matrix,
+                    monthly_rollup, save_monthly_rollup, has_fresh_rollup)
+from stage_cache import cached_stage
+from segment_stats import segment_codes
+from parallel_groupby import group_aggregate
+from calendar_keys import month_label, week_label
 
 init()
 
-def list_available_files():
-    """Liệt kê các file dữ liệu có sẵn"""
-    files = [f for f in os.listdir('output') if f.startswith('transactions_')]
-    if not files:
-        print(f"\n{Fore.RED}Không tìm thấy file dữ liệu nào trong thư mục output!{Style.RESET_ALL}")
-        return None
-
-    print(f"\n{Fore.YELLOW}Danh sách file dữ liệu:{Style.RESET_ALL}")
-    for i, file in enumerate(files, 1):
-        file_path = os.path.join('output', file)
-        file_size = os.path.getsize(file_path) / (1024 * 1024)  # Convert to MB
-        print(f"{i}. {file} ({file_size:.1f} MB)")
-
-    while True:
-        try:
-            choice = input(f"\n{Fore.YELLOW}Chọn file để phân tích (1-{len(files)}): {Style.RESET_ALL}")
-            idx = int(choice) - 1
-            if 0 <= idx < len(files):
-                return files[idx].replace('transactions_', '').replace('.csv', '')
-        except ValueError:
-            pass
-        print(f"{Fore.RED}Lựa chọn không hợp lệ!{Style.RESET_ALL}")
-
-
 def load_data(student_id):
     """Đọc và chuẩn bị dữ liệu"""
     print(f"{Fore.BLUE}[1/4] Đọc dữ liệu{Style.RESET_ALL}")
@@ -38,66 +23,118 @@ def load_data(student_id):
     input_file = os.path.join('output', f'transactions_{student_id}.csv')
     print(f"File: {input_file}")
 
-    df = pd.read_csv(input_file,
-                    dtype={
-                        'customer_id': str,
-                        'price': float,
-                        'quantity': int,
-                        'discount': float
-                    },
-                    parse_dates=['order_date'])
+    def read():
+        # Dùng lại dữ liệu gốc nếu bước tiền xử lý đã đọc file trong phiên
+        df = session_cache.lookup(student_id, 'raw')
+        if df is None:
+            df = read_transactions(input_file)
+
+        # Chỉ lấy dữ liệu tốt (không có NaN)
+        df = df.dropna()
 
-    # Chỉ lấy dữ liệu tốt (không có NaN)
-    df = df.dropna()
+        # Tạo cột total_amount nếu chưa có
+        if 'total_amount' not in df.columns:
+            df['total_amount'] = kernels.total_amount(df['quantity'], df['price'], df['discount'])
+        return df
 
-    # Tạo cột total_amount nếu chưa có
-    if 'total_amount' not in df.columns:
-        df['total_amount'] = round(df['quantity'] * df['price'] * (1 - df['discount']), 2)
+    df = session_cache.cached_frame(student_id, 'clean', read)
 
     print(f"→ Đã đọc: {len(df):,} dòng")
     return df
 
-def analyze_weekly_spending(df):
-    """Phân tích chi tiêu theo tuần"""
-    print(f"\n{Fore.BLUE}[2/4] Phân tích chi tiêu theo tuần{Style.RESET_ALL}")
-
-    # Thêm cột tuần
-    df['week'] = df['order_date'].dt.isocalendar().week
-    df['year'] = df['order_date'].dt.isocalendar().year
+def weekly_matrix_stats(matrix, customers, weeks):
+    """Thống kê theo khách hàng và theo tuần trên ma trận chi tiêu thưa
+
+    Chỉ tính các tuần có giao dịch (ô được lưu), giống bảng dạng dài.
+    Trả về (customer_stats, week_stats).
+    """
+    matrix = matrix.tocsr()
+    values = matrix.data.astype(np.float64)
+    weeks_active = np.diff(matrix.indptr)
+    starts = matrix.indptr[:-1][weeks_active > 0]
+
+    customer_stats = pd.DataFrame({
+        'weeks_active': weeks_active,
+        'total': np.bincount(np.repeat(np.arange(len(customers)), weeks_active), values,
+                             minlength=len(customers)),
+        'min': np.nan,
+        'max': np.nan
+    }, index=pd.Index(customers, name='customer_id'))
+    customer_stats['mean'] = customer_stats['total'] / weeks_active
+    customer_stats.loc[weeks_active > 0, 'min'] = np.minimum.reduceat(values, starts)
+    customer_stats.loc[weeks_active > 0, 'max'] = np.maximum.reduceat(values, starts)
+
+    customers_active = np.bincount(matrix.indices, minlength=len(weeks))
+    week_stats = pd.DataFrame({
+        'customers': customers_active,
+        'total': np.bincount(matrix.indices, values, minlength=len(weeks))
+    }, index=pd.Index([week_label(w) for w in weeks], name='week_label'))
+    week_stats['mean'] = week_stats['total'] / customers_active
+
+    return customer_stats, week_stats
+
+def analyze_weekly_spending(df, hourly=None, as_matrix=False):
+    """Tính chi tiêu theo tuần
+
+    Mặc định trả về bảng dạng dài (mỗi dòng một khách hàng - tuần). Với
+    as_matrix=True trả về (matrix, customers, weeks): ma trận thưa CSR float32
+    khách hàng × tuần, dùng trực tiếp được cho KMeans.
+    """
+    # Tổng hợp từ bảng theo giờ thay vì quét lại dữ liệu gốc
+    if hourly is None:
+        hourly = build_hourly_rollup(df)
+
+    if as_matrix:
+        return weekly_matrix(hourly)
 
     # Tính tổng chi tiêu theo tuần và customer_id
-    weekly_spending = df.groupby(['customer_id', 'year', 'week'])['total_amount'].sum().reset_index()
+    weekly_spending = weekly_rollup(hourly)[['customer_id', 'year', 'week', 'revenue']]
+    weekly_spending = weekly_spending.rename(columns={'revenue': 'total_amount'})
     weekly_spending['week_label'] = weekly_spending['year'].astype(str) + '-W' + weekly_spending['week'].astype(str).str.zfill(2)
+    return weekly_spending
 
-    print("\nMẫu chi tiêu theo tuần:")
-    print(weekly_spending.head().to_string())
+def print_weekly_spending(weekly_spending):
+    """In kết quả phân tích chi tiêu theo tuần (bảng dạng dài hoặc ma trận thưa)"""
+    print(f"\n{Fore.BLUE}[2/4] Phân tích chi tiêu theo tuần{Style.RESET_ALL}")
+
+    if isinstance(weekly_spending, tuple):
+        matrix, customers, weeks = weekly_spending
+        size = (matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes) / (1024 * 1024)
+        print(f"\nMa trận chi tiêu: {matrix.shape[0]:,} khách hàng × {matrix.shape[1]:,} tuần "
+              f"({matrix.nnz:,} ô có giá trị, {size:.1f} MB)")
+
+        stats, week_stats = weekly_matrix_stats(matrix, customers, weeks)
+        print("\nMẫu chi tiêu theo tuần (toàn bộ khách hàng):")
+        print(week_stats.head().to_string())
+    else:
+        print("\nMẫu chi tiêu theo tuần:")
+        print(weekly_spending.head().to_string())
+        stats = weekly_spending.groupby('customer_id')['total_amount'].agg(['mean', 'min', 'max'])
 
     print(f"\nThống kê chi tiêu theo tuần:")
-    stats = weekly_spending.groupby('customer_id')['total_amount'].agg(['mean', 'min', 'max'])
     print(f"→ Chi tiêu trung bình/tuần: ${stats['mean'].mean():.2f}")
     print(f"→ Chi tiêu thấp nhất/tuần: ${stats['min'].min():.2f}")
     print(f"→ Chi tiêu cao nhất/tuần: ${stats['max'].max():.2f}")
 
-    return weekly_spending
-
 def analyze_customer_behavior(df):
-    """Phân tích hành vi khách hàng"""
-    print(f"\n{Fore.BLUE}[3/4] Phân tích hành vi khách hàng{Style.RESET_ALL}")
-
-    customer_behavior = pd.DataFrame()
-
-    # 1. Tổng số đơn hàng
-    customer_behavior['total_orders'] = df.groupby('customer_id').size()
+    """Tính thống kê hành vi khách hàng"""
+    # Loại sản phẩm (dựa trên giá và số lượng) dạng mã số nguyên
+    product_type, _ = segment_codes([df['price'], df['quantity']])
 
-    # 2. Tổng chi tiêu
-    customer_behavior['total_spending'] = df.groupby('customer_id')['total_amount'].sum()
-
-    # 3. Số loại sản phẩm (dựa trên giá và số lượng)
-    df['product_type'] = df['price'].astype(str) + '_' + df['quantity'].astype(str)
-    customer_behavior['unique_products'] = df.groupby('customer_id')['product_type'].nunique()
+    # Tổng hợp theo khách hàng (chia cho nhiều tiến trình khi dữ liệu lớn)
+    customer_behavior = group_aggregate([df['customer_id']], {
+        'total_orders': (None, 'size'),                  # 1. Tổng số đơn hàng
+        'total_spending': (df['total_amount'], 'sum'),   # 2. Tổng chi tiêu
+        'unique_products': (product_type, 'nunique')     # 3. Số loại sản phẩm
+    })
 
     # Thêm thống kê bổ sung
     customer_behavior['avg_order_value'] = customer_behavior['total_spending'] / customer_behavior['total_orders']
+    return customer_behavior
+
+def print_customer_behavior(customer_behavior):
+    """In kết quả phân tích hành vi khách hàng"""
+    print(f"\n{Fore.BLUE}[3/4] Phân tích hành vi khách hàng{Style.RESET_ALL}")
 
     print("\nThống kê hành vi khách hàng:")
     print(customer_behavior.to_string())
@@ -107,37 +144,36 @@ def analyze_customer_behavior(df):
     print(f"→ Trung bình chi tiêu/khách: ${customer_behavior['total_spending'].mean():.2f}")
     print(f"→ Trung bình số loại SP/khách: {customer_behavior['unique_products'].mean():.0f}")
 
-    return customer_behavior
-
-def analyze_monthly_trends(df):
-    """Phân tích xu hướng theo tháng"""
-    print(f"\n{Fore.BLUE}[4/4] Phân tích xu hướng theo tháng{Style.RESET_ALL}")
-
-    # Thêm cột tháng
-    df['year_month'] = df['order_date'].dt.to_period('M')
+def analyze_monthly_trends(df, hourly=None, monthly=None):
+    """Tìm khách hàng có số đơn giảm liên tiếp trong 3 tháng"""
+    if monthly is None:
+        monthly = monthly_rollup(build_hourly_rollup(df) if hourly is None else hourly)
 
     # Tính số đơn hàng theo tháng cho mỗi khách hàng
-    monthly_orders = df.groupby(['customer_id', 'year_month']).size().reset_index(name='num_orders')
+    monthly_orders = monthly[['customer_id', 'year_month', 'order_count']]
+    monthly_orders = monthly_orders.rename(columns={'order_count': 'num_orders'})
 
     # Sắp xếp theo customer_id và tháng
     monthly_orders = monthly_orders.sort_values(['customer_id', 'year_month'])
 
-    # Tìm khách hàng có số đơn giảm liên tiếp trong 3 tháng
-    declining_customers = []
+    # Tìm khách hàng có số đơn giảm liên tiếp trong 3 tháng (quét một lần trên toàn bảng)
+    customers = monthly_orders['customer_id'].to_numpy()
+    months = monthly_orders['year_month'].to_numpy()
+    orders = monthly_orders['num_orders'].to_numpy()
+    codes, _ = pd.factorize(customers)
 
-    for customer in monthly_orders['customer_id'].unique():
-        customer_data = monthly_orders[monthly_orders['customer_id'] == customer]
+    declining_customers = []
+    for i in kernels.declining_starts(codes, orders):
+        declining_customers.append({
+            'customer_id': customers[i],
+            'period': f"{month_label(months[i])} to {month_label(months[i + 2])}",
+            'orders': orders[i:i + 3]
+        })
+    return declining_customers
 
-        if len(customer_data) >= 3:
-            # Tính sự thay đổi giữa các tháng liên tiếp
-            for i in range(len(customer_data) - 2):
-                orders_3m = customer_data['num_orders'].iloc[i:i+3].values
-                if all(orders_3m[i] > orders_3m[i+1] for i in range(2)):
-                    declining_customers.append({
-                        'customer_id': customer,
-                        'period': f"{customer_data['year_month'].iloc[i]} to {customer_data['year_month'].iloc[i+2]}",
-                        'orders': orders_3m
-                    })
+def print_monthly_trends(declining_customers):
+    """In kết quả phân tích xu hướng theo tháng"""
+    print(f"\n{Fore.BLUE}[4/4] Phân tích xu hướng theo tháng{Style.RESET_ALL}")
 
     print("\nKhách hàng có số đơn giảm liên tiếp trong 3 tháng:")
     if declining_customers:
@@ -148,9 +184,32 @@ def analyze_monthly_trends(df):
     else:
         print("→ Không tìm thấy khách hàng nào")
 
-    return declining_customers
+def run_analyses(student_id, as_matrix=False):
+    """Đọc dữ liệu và tính các phân tích theo tuần, theo khách hàng, theo tháng (không in)
+
+    Trả về cả bảng tổng hợp theo tháng để analyze_data lưu lại (kể cả khi kết
+    quả lấy từ cache các bước).
+    """
+    # 1. Đọc dữ liệu
+    df = load_data(student_id)
+
+    # Bảng tổng hợp theo giờ dùng chung cho phân tích theo tuần và theo tháng
+    hourly = load_hourly_rollup(student_id, lambda: df)
+
+    # 2. Phân tích chi tiêu theo tuần
+    weekly_spending = analyze_weekly_spending(df, hourly, as_matrix=as_matrix)
+
+    # 3. Phân tích hành vi khách hàng
+    customer_behavior = analyze_customer_behavior(df)
+
+    # 4. Phân tích xu hướng theo tháng
+    monthly = monthly_rollup(hourly)
+    declining_customers = analyze_monthly_trends(df, monthly=monthly)
 
-def analyze_data(student_id=None):
+    return weekly_spending, customer_behavior, declining_customers, monthly
+
+def analyze_data(student_id=None, as_matrix=False):
+    """Chạy các phân tích; as_matrix=True trả chi tiêu theo tuần dạng ma trận thưa"""
     print(f"\n{Fore.GREEN}Bắt đầu phân tích dữ liệu...{Style.RESET_ALL}")
     print("=" * 50)
 
@@ -159,17 +218,21 @@ def analyze_data(student_id=None):
         if student_id is None:
             return None
 
-    # 1. Đọc dữ liệu
-    df = load_data(student_id)
-
-    # 2. Phân tích chi tiêu theo tuần
-    weekly_spending = analyze_weekly_spending(df)
+    # 1-4. Phân tích (dùng lại kết quả nếu file không đổi)
+    input_file = os.path.join('output', f'transactions_{student_id}.csv')
+    weekly_spending, customer_behavior, declining_customers, monthly = cached_stage(
+        'analyze', input_file, {'as_matrix': as_matrix},
+        lambda: run_analyses(student_id, as_matrix))
 
-    # 3. Phân tích hành vi khách hàng
-    customer_behavior = analyze_customer_behavior(df)
+    # Bảng theo tháng cho chế độ gần đúng: lưu ngoài cache các bước để file luôn có và
+    # còn mới (file giao dịch bị chạm vào, hoặc bộ dữ liệu khác có cùng nội dung)
+    if not has_fresh_rollup(student_id, 'monthly'):
+        save_monthly_rollup(student_id, monthly)
 
-    # 4. Phân tích xu hướng theo tháng
-    declining_customers = analyze_monthly_trends(df)
+    # In kết quả (cả khi tính mới lẫn khi dùng kết quả đã lưu)
+    print_weekly_spending(weekly_spending)
+    print_customer_behavior(customer_behavior)
+    print_monthly_trends(declining_customers)
 
     print("\n" + "=" * 50)
     print(f"{Fore.GREEN}Hoàn thành phân tích dữ liệu!{Style.RESET_ALL}")
@@ -179,6 +242,6 @@ def analyze_data(student_id=None):
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         student_id = sys.argv[1]
-        analyze_data(student_id)
+        analyze_data(student_id, as_matrix=sys.argv[2:3] == ['matrix'])
     else:
-        print("Usage: python analyze_data.py <student_id>")
+        print("Usage: python analyze_data.py <student_id> [matrix]")
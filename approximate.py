@@ -0,0 +1,316 @@
+import sys
+import os
+import io
+import time
+import numpy as np
+import pandas as pd
+from colorama import init, Fore, Style
+from datasets import list_available_files, dataset_path, parse_order_dates, DTYPES, FAST_ENGINE
+from calendar_keys import calendar_keys
+from rollup import load_monthly_rollup
+import kernels
+
+init()
+
+# Kích thước mỗi khối byte được đọc khi lấy mẫu
+BLOCK_BYTES = 4096
+
+# Số lần lặp bootstrap theo khối để tính khoảng tin cậy
+BOOTSTRAP_REPLICATES = 200
+
+def read_sample_blocks(input_file, fraction, block_bytes=BLOCK_BYTES, seed=42):
+    """Đọc ngẫu nhiên khoảng fraction số khối byte của file, không quét phần còn lại
+
+    Mỗi dòng thuộc về khối chứa byte đầu tiên của nó, nên mọi dòng có cùng xác
+    suất được chọn. Trả về (các dòng đọc được kèm cột block là thứ tự khối mẫu
+    chứa dòng, số khối đã đọc, tổng số khối).
+    """
+    rng = np.random.default_rng(seed)
+    size = os.path.getsize(input_file)
+    pieces, lines = [], []
+    with open(input_file, 'rb') as f:
+        header_line = f.readline()
+        header = header_line.decode('utf-8').strip().split(',')
+        data_start = len(header_line)
+        n_blocks = max(-(-(size - data_start) // block_bytes), 1)
+        # Ít nhất 2 khối (nếu file có đủ) để bootstrap theo khối có thể ước lượng sai số
+        n_chosen = min(max(int(np.ceil(fraction * n_blocks)), 2), n_blocks)
+
+        for block in np.sort(rng.choice(n_blocks, n_chosen, replace=False)):
+            # Đọc thêm byte ngay trước khối để biết dòng đầu tiên có bắt đầu trong khối không
+            start = data_start + int(block) * block_bytes
+            f.seek(start - 1)
+            data = f.read(block_bytes + 1)
+            first = data.find(b'\n') + 1
+            body = data[first:] if first else b''  # Không có dòng nào bắt đầu trong khối
+            if body and not body.endswith(b'\n'):
+                body += f.readline()  # Đọc nốt dòng cuối bắt đầu trong khối
+            if body and not body.endswith(b'\n'):
+                body += b'\n'  # Dòng cuối file không có ký tự xuống dòng
+            pieces.append(body)
+            lines.append(body.count(b'\n'))
+
+    # Engine pyarrow không nhận usecols khi header=None nên lọc cột sau khi đọc
+    columns = ['customer_id', 'order_date', 'price', 'quantity', 'discount']
+    sample = pd.read_csv(io.BytesIO(b''.join(pieces)), header=None, names=header,
+                         dtype=DTYPES, engine=FAST_ENGINE, skip_blank_lines=False)[columns]
+    if len(sample) != sum(lines):
+        raise ValueError(f"Số dòng đọc được ({len(sample):,}) khác số dòng của các khối ({sum(lines):,})")
+    sample['order_date'] = parse_order_dates(sample['order_date'])
+    sample['block'] = np.repeat(np.arange(n_chosen), lines)
+    return sample, n_chosen, n_blocks
+
+def collapse_strata(counts, sample_counts, min_per_stratum=2):
+    """Gộp các tầng có ít hơn min_per_stratum khối mẫu vào tầng cả tháng, rồi vào một tầng chung
+
+    sample_counts là số khối mẫu (đơn vị lấy mẫu) có dòng thuộc từng tầng: tầng
+    chỉ có một khối thì bootstrap theo khối không thấy được sai số của nó. Số
+    khối của tầng gộp được tính bằng tổng số khối của các tầng con.
+
+    Tầng không có dòng mẫu nào không được ước lượng: số dòng của chúng được chia
+    cho các tầng có mẫu theo tỷ lệ số dòng. Nếu tầng chung vẫn không đủ mẫu, các
+    tầng của nó được gộp vào tầng nhiều mẫu nhất; khi không còn tầng nào đủ mẫu
+    thì toàn bộ dữ liệu được coi là một tầng.
+
+    counts và sample_counts có cùng index (customer_id, month). Trả về (labels,
+    population): labels là chỉ số tầng ước lượng của từng tầng gốc, population
+    là số dòng thật của mỗi tầng ước lượng.
+    """
+    months = counts.index.get_level_values('month')
+    labels = pd.Series(np.arange(len(counts)), index=counts.index)
+    samples = sample_counts.to_numpy()
+
+    empty = samples == 0
+    small = (samples < min_per_stratum) & ~empty
+    month_samples = sample_counts[small].groupby(months[small]).sum()
+    month_ok = month_samples.index[month_samples >= min_per_stratum]
+
+    to_month = small & months.isin(month_ok)
+    to_global = small & ~months.isin(month_ok)
+    labels[to_month] = len(counts) + month_ok.get_indexer(months[to_month])
+    labels[to_global] = len(counts) + len(month_ok)
+    if samples[to_global].sum() < min_per_stratum and to_global.any():
+        # Tầng chung không đủ mẫu để ước lượng: gộp vào tầng nhiều mẫu nhất
+        estimable = ~small & ~empty | to_month
+        if estimable.any():
+            labels[to_global] = labels[estimable].iloc[np.argmax(samples[estimable])]
+        else:
+            labels[:] = 0  # Không còn tầng nào đủ mẫu: một tầng cho toàn bộ
+    labels[empty] = labels[~empty].iloc[0]
+
+    labels, _ = pd.factorize(labels.to_numpy())
+    counts = counts.to_numpy().astype(np.float64)
+    population = np.bincount(labels, np.where(empty, 0, counts))
+    population *= counts.sum() / population.sum()
+    return labels, population
+
+def sample_transactions(student_id, fraction=0.01, min_per_stratum=2, seed=42):
+    """Lấy mẫu ngẫu nhiên theo khối byte, hậu phân tầng theo (khách hàng, tháng) nếu có thể
+
+    Chỉ đọc các khối được chọn của file. Số dòng thật của từng tầng lấy từ bảng
+    tổng hợp theo tháng (hoặc theo giờ) đã lưu; bảng không được tạo ở bước này
+    vì việc đó phải đọc toàn bộ file. Khi chưa có bảng tổng hợp, mẫu không được
+    phân tầng và số dòng được ước lượng từ các khối. Tầng có dòng từ ít hơn
+    min_per_stratum khối mẫu được gộp vào tầng cả tháng hoặc tầng chung.
+
+    Trả về (mẫu có cột block và stratum, thiết kế mẫu cho estimate_metrics).
+    """
+    print(f"{Fore.BLUE}[1/4] Lấy mẫu theo khối, phân tầng theo khách hàng và tháng{Style.RESET_ALL}")
+
+    input_file = dataset_path(student_id)
+    print(f"File: {input_file}")
+
+    sample, n_chosen, n_blocks = read_sample_blocks(input_file, fraction, seed=seed)
+    # Chỉ lấy dữ liệu tốt (không có NaN), giống các bước phân tích chính xác
+    sample = sample.dropna()
+    sample['total_amount'] = kernels.total_amount(sample['quantity'], sample['price'], sample['discount'])
+    sample['month'] = calendar_keys(sample['order_date'])['month']
+    design = {'blocks': n_blocks, 'sampled_blocks': n_chosen, 'population': None, 'num_customers': None}
+    print(f"→ Đã đọc {n_chosen:,}/{n_blocks:,} khối ({BLOCK_BYTES // 1024} KB)")
+
+    # Số dòng thật của từng tầng (khách hàng × tháng), chỉ khi đã có bảng tổng hợp
+    monthly = load_monthly_rollup(student_id)
+    if monthly is None:
+        print(f"{Fore.YELLOW}→ Chưa có bảng tổng hợp (chạy analyze_data.py để tạo): "
+              f"không phân tầng, số dòng được ước lượng từ các khối{Style.RESET_ALL}")
+        sample['stratum'] = 0
+        sample = sample.reset_index(drop=True)
+        print(f"→ Số dòng mẫu: {len(sample):,}")
+        return sample, design
+
+    counts = monthly.set_index(['customer_id', 'year_month'])['order_count']
+    counts.index = counts.index.set_names(['customer_id', 'month'])
+
+    strata = counts.index.get_indexer(pd.MultiIndex.from_arrays([sample['customer_id'], sample['month']]))
+    sample = sample[strata >= 0]
+    strata = strata[strata >= 0]
+    # Số khối mẫu khác nhau có dòng thuộc từng tầng
+    stratum_blocks = np.unique(np.column_stack([strata, sample['block'].to_numpy()]), axis=0)[:, 0]
+    sample_counts = pd.Series(np.bincount(stratum_blocks, minlength=len(counts)), index=counts.index)
+    labels, population = collapse_strata(counts, sample_counts, min_per_stratum)
+    sample['stratum'] = labels[strata]
+    sample = sample.reset_index(drop=True)
+    design['population'] = population
+    design['num_customers'] = counts.index.get_level_values('customer_id').nunique()
+
+    print(f"→ Số dòng dữ liệu: {counts.sum():,}")
+    print(f"→ Số tầng (khách hàng × tháng): {len(counts):,}, sau khi gộp tầng ít mẫu: {len(population):,}")
+    print(f"→ Số dòng mẫu: {len(sample):,} ({len(sample) / counts.sum():.2%})")
+    return sample, design
+
+def row_weights(sample, design, multiplicity):
+    """Trọng số của từng dòng mẫu khi khối mẫu thứ i được lấy multiplicity[i] lần
+
+    Có phân tầng: trọng số hậu phân tầng N_h / n_h (tầng không còn dòng nào có
+    trọng số 0). Không phân tầng: mỗi khối đại diện cho blocks / sampled_blocks khối.
+    Trả về (trọng số, số dòng ước lượng).
+    """
+    counts = multiplicity[sample['block'].to_numpy()].astype(np.float64)
+    if design['population'] is None:
+        weights = counts * design['blocks'] / design['sampled_blocks']
+        return weights, weights.sum()
+
+    population = design['population']
+    codes = sample['stratum'].to_numpy()
+    n_h = np.bincount(codes, counts, minlength=len(population))
+    scale = np.divide(population, n_h, out=np.zeros_like(population), where=n_h > 0)
+    return counts * scale[codes], population.sum()
+
+def weighted_quantiles(sorted_values, weights, qs):
+    """Phân vị có trọng số, nội suy tuyến tính như pandas khi các trọng số bằng nhau
+
+    Giá trị thứ i (đã sắp xếp) nằm ở vị trí (tổng trọng số trước nó) / (tổng
+    trọng số trừ trọng số của giá trị cuối); dòng có trọng số 0 bị bỏ qua.
+    """
+    keep = weights > 0
+    sorted_values, weights = sorted_values[keep], weights[keep]
+    if len(weights) == 1:
+        return np.repeat(sorted_values, len(qs))
+    before = np.cumsum(weights) - weights
+    return np.interp(qs, before / before[-1], sorted_values)
+
+def compute_metrics(amounts, order, quantity, discount, weights, total_rows, num_customers,
+                    threshold=3, multiplier=5):
+    """Các chỉ số của analyze_data và detect_anomalies từ mẫu có trọng số
+
+    order là thứ tự sắp xếp của amounts (tính một lần cho mọi lần lặp bootstrap).
+    Ngưỡng và tỷ lệ bất thường được tính lại từ chính các trọng số này.
+    """
+    total = weights.sum()
+    mean = weights @ amounts / total
+    std = np.sqrt(max(weights @ (amounts * amounts) / total - mean ** 2, 0))
+
+    q1, median, q3 = weighted_quantiles(amounts[order], weights[order], [0.25, 0.5, 0.75])
+    iqr = q3 - q1
+
+    def rate(mask):
+        return weights @ mask / total
+
+    return {
+        'total_orders': total_rows,
+        'total_revenue': mean * total_rows,
+        'avg_order_value': mean,
+        'avg_spending_per_customer': mean * total_rows / num_customers if num_customers else np.nan,
+        'avg_items_per_order': weights @ quantity / total,
+        'avg_discount': weights @ discount / total,
+        'zscore_upper_bound': mean + threshold * std,
+        'q1': q1,
+        'q3': q3,
+        'median': median,
+        'iqr_upper_bound': q3 + 1.5 * iqr,
+        'median_threshold': median * multiplier,
+        'zscore_anomaly_rate': rate(np.abs(amounts - mean) > threshold * std),
+        'iqr_anomaly_rate': rate((amounts < q1 - 1.5 * iqr) | (amounts > q3 + 1.5 * iqr)),
+        'median_anomaly_rate': rate(amounts > median * multiplier)
+    }
+
+def estimate_metrics(sample, design, confidence=0.95, threshold=3, multiplier=5,
+                     replicates=BOOTSTRAP_REPLICATES, seed=42):
+    """Ước lượng các chỉ số của analyze_data và detect_anomalies kèm khoảng tin cậy
+
+    Khoảng tin cậy lấy bằng bootstrap theo khối: mẫu được lấy theo từng khối
+    các dòng liền nhau nên khối (không phải từng dòng) là đơn vị lấy mẫu. Mỗi
+    lần lặp tính lại cả các ngưỡng nên tỷ lệ bất thường tính đến sai số của ngưỡng.
+    Độ phủ thực tế của khoảng có thể thấp hơn confidence vài điểm phần trăm.
+    """
+    amounts = sample['total_amount'].to_numpy(dtype=np.float64)
+    quantity = sample['quantity'].to_numpy(dtype=np.float64)
+    discount = sample['discount'].to_numpy(dtype=np.float64)
+    order = np.argsort(amounts, kind='stable')
+    k = design['sampled_blocks']
+
+    def metrics(multiplicity):
+        weights, total_rows = row_weights(sample, design, multiplicity)
+        return compute_metrics(amounts, order, quantity, discount, weights, total_rows,
+                               design['num_customers'], threshold, multiplier)
+
+    estimates = metrics(np.ones(k, dtype=np.int64))
+    if sample['block'].nunique() < 2:
+        # Chỉ một khối có dữ liệu: bootstrap theo khối không cho biết gì về sai số
+        print(f"{Fore.YELLOW}→ Mẫu chỉ có một khối dữ liệu: "
+              f"không tính được khoảng tin cậy{Style.RESET_ALL}")
+        low = high = pd.Series(np.nan, index=list(estimates))
+    else:
+        rng = np.random.default_rng(seed)
+        draws = pd.DataFrame([metrics(rng.multinomial(k, np.full(k, 1 / k)))
+                              for _ in range(replicates)])
+        low = draws.quantile((1 - confidence) / 2)
+        high = draws.quantile((1 + confidence) / 2)
+
+    rows = []
+    sections = {'total_orders': "[2/4] Ước lượng tổng và trung bình",
+                'zscore_upper_bound': "[3/4] Ước lượng ngưỡng phát hiện bất thường",
+                'zscore_anomaly_rate': "[4/4] Ước lượng tỷ lệ giao dịch bất thường"}
+    for metric, estimate in estimates.items():
+        if metric in sections:
+            print(f"\n{Fore.BLUE}{sections[metric]}{Style.RESET_ALL}")
+        if np.isnan(estimate):
+            print(f"→ {metric}: không ước lượng được (chưa có số khách hàng từ bảng tổng hợp)")
+            continue
+        rows.append({'metric': metric, 'estimate': estimate, 'ci_low': low[metric], 'ci_high': high[metric]})
+        print(f"→ {metric}: {estimate:,.4f} [{low[metric]:,.4f}, {high[metric]:,.4f}]")
+
+    return pd.DataFrame(rows)
+
+def approximate_analysis(student_id=None, fraction=0.01, confidence=0.95, threshold=3, multiplier=5):
+    """Phân tích gần đúng trên mẫu phân tầng, kèm khoảng tin cậy"""
+    print(f"\n{Fore.GREEN}Bắt đầu phân tích gần đúng...{Style.RESET_ALL}")
+    print("=" * 50)
+
+    if student_id is None:
+        student_id = list_available_files()
+        if student_id is None:
+            return None
+
+    start = time.perf_counter()
+
+    # 1. Lấy mẫu
+    sample, design = sample_transactions(student_id, fraction)
+
+    # 2-4. Ước lượng
+    estimates = estimate_metrics(sample, design, confidence, threshold, multiplier)
+
+    output_file = os.path.join('output', f'approx_estimates_{student_id}.csv')
+    estimates.to_csv(output_file, index=False)
+
+    print(f"\n{Fore.GREEN}Tổng kết:{Style.RESET_ALL}")
+    print(f"→ Độ tin cậy danh nghĩa: {confidence:.0%}, tỷ lệ lấy mẫu: {fraction:.2%}")
+    print(f"{Fore.YELLOW}→ Khoảng tin cậy là khoảng bootstrap theo khối, không bảo đảm đúng {confidence:.0%}: "
+          f"trên dữ liệu thử (100 lần lấy mẫu, tỷ lệ 1% và 5%) khoảng danh nghĩa 95% chứa giá trị "
+          f"chính xác 91-100% số lần tùy chỉ số{Style.RESET_ALL}")
+    print(f"→ Thời gian: {time.perf_counter() - start:.1f}s")
+    print(f"→ Đã lưu kết quả vào file: {output_file}")
+    print(f"→ Kết quả chính xác: python analyze_data.py {student_id} / python detect_anomalies.py {student_id}")
+
+    print("\n" + "=" * 50)
+    print(f"{Fore.GREEN}Hoàn thành phân tích gần đúng!{Style.RESET_ALL}")
+
+    return estimates
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        student_id = sys.argv[1]
+        fraction = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+        approximate_analysis(student_id, fraction)
+    else:
+        print("Usage: python approximate.py <student_id> [fraction]")
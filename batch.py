@@ -0,0 +1,177 @@
+import os
+import time
+import argparse
+import contextlib
+import importlib
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+from colorama import init, Fore, Style
+from datasets import find_datasets, dataset_path
+
+init()
+
+# Các bước xử lý: tên bước → (module, hàm nhận student_id)
+STAGES = {
+    'process': ('process_data', 'process_data'),
+    'analyze': ('analyze_data', 'analyze_data'),
+    'detect': ('detect_anomalies', 'detect_anomalies'),
+    'advanced': ('advanced_analysis', 'analyze_advanced'),
+    'approx': ('approximate', 'approximate_analysis'),
+}
+
+# Các bước chạy mặc định khi xử lý hàng loạt
+DEFAULT_STAGES = ['process', 'analyze', 'detect', 'advanced']
+
+# Ước lượng bộ nhớ cần cho một bộ dữ liệu: khoảng N lần dung lượng file CSV
+MEMORY_FACTOR = 8
+
+def available_memory():
+    """Dung lượng RAM còn trống (bytes), None nếu không xác định được"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def estimate_memory(student_id):
+    """Ước lượng bộ nhớ cần để xử lý một bộ dữ liệu"""
+    return os.path.getsize(dataset_path(student_id)) * MEMORY_FACTOR
+
+def run_stage(stage, student_id, **params):
+    """Chạy một bước xử lý cho một bộ dữ liệu"""
+    module_name, func_name = STAGES[stage]
+    func = getattr(importlib.import_module(module_name), func_name)
+    return func(student_id, **params)
+
+def _init_worker():
+    """Khởi tạo tiến trình con: vẽ biểu đồ không cần màn hình"""
+    os.environ['MPLBACKEND'] = 'Agg'
+
+def run_dataset(student_id, stages, log_dir):
+    """Chạy lần lượt các bước cho một bộ dữ liệu, ghi log ra file riêng"""
+    results = []
+    log_file = os.path.join(log_dir, f'batch_{student_id}.log')
+    with open(log_file, 'w', encoding='utf-8') as log, \
+            contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        for stage in stages:
+            start = time.perf_counter()
+            try:
+                run_stage(stage, student_id)
+                status, error = 'ok', ''
+            except Exception as e:
+                traceback.print_exc()
+                status, error = 'error', str(e)
+            results.append({
+                'dataset': student_id,
+                'stage': stage,
+                'status': status,
+                'seconds': round(time.perf_counter() - start, 2),
+                'error': error,
+                'log_file': log_file
+            })
+    return results
+
+def run_batch(stages=None, workers=None, memory_limit=None, datasets=None):
+    """Chạy các bước xử lý cho mọi bộ dữ liệu trong output/ bằng nhiều tiến trình
+
+    Một bộ dữ liệu chỉ được đưa vào chạy khi tổng bộ nhớ ước lượng của các
+    bộ đang chạy vẫn nằm trong giới hạn memory_limit (bytes).
+    """
+    print(f"\n{Fore.GREEN}Bắt đầu xử lý hàng loạt...{Style.RESET_ALL}")
+    print("=" * 50)
+
+    stages = stages or DEFAULT_STAGES
+    workers = workers or os.cpu_count() or 1
+    if memory_limit is None:
+        available = available_memory()
+        memory_limit = int(available * 0.8) if available else None
+
+    datasets = datasets if datasets is not None else find_datasets()
+    if not datasets:
+        print(f"{Fore.RED}Không tìm thấy file dữ liệu nào trong thư mục output!{Style.RESET_ALL}")
+        return None
+
+    log_dir = os.path.join('output', 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+
+    print(f"→ Số bộ dữ liệu: {len(datasets):,}")
+    print(f"→ Các bước: {', '.join(stages)}")
+    print(f"→ Số tiến trình tối đa: {workers}")
+    if memory_limit:
+        print(f"→ Giới hạn bộ nhớ: {memory_limit / (1024 * 1024):,.0f} MB")
+
+    # Xếp bộ dữ liệu lớn lên trước để tránh một bộ lớn chạy cuối cùng
+    pending = sorted(datasets, key=estimate_memory, reverse=True)
+    running = {}
+    results = []
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        while pending or running:
+            # Nhận thêm việc khi còn tiến trình rảnh và còn đủ bộ nhớ
+            in_use = sum(mem for _, mem in running.values())
+            while pending and len(running) < workers:
+                needed = estimate_memory(pending[0])
+                if running and memory_limit and in_use + needed > memory_limit:
+                    break
+                student_id = pending.pop(0)
+                future = executor.submit(run_dataset, student_id, stages, log_dir)
+                running[future] = (student_id, needed)
+                in_use += needed
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                student_id, _ = running.pop(future)
+                try:
+                    dataset_results = future.result()
+                except Exception as e:
+                    dataset_results = [{'dataset': student_id, 'stage': stage, 'status': 'error',
+                                        'seconds': 0.0, 'error': str(e), 'log_file': ''}
+                                       for stage in stages]
+                results.extend(dataset_results)
+
+                failed = [r['stage'] for r in dataset_results if r['status'] != 'ok']
+                if failed:
+                    print(f"{Fore.RED}✗ {student_id}: lỗi ở bước {', '.join(failed)}{Style.RESET_ALL}")
+                else:
+                    seconds = sum(r['seconds'] for r in dataset_results)
+                    print(f"{Fore.GREEN}✓ {student_id} ({seconds:.1f}s){Style.RESET_ALL}")
+
+    summary = pd.DataFrame(results, columns=['dataset', 'stage', 'status', 'seconds', 'error', 'log_file'])
+    output_file = os.path.join('output', 'batch_summary.csv')
+    summary.to_csv(output_file, index=False)
+
+    print(f"\n{Fore.GREEN}Tổng kết:{Style.RESET_ALL}")
+    print(f"→ Thời gian: {time.perf_counter() - start:.1f}s")
+    print(f"→ Số bước thành công: {(summary['status'] == 'ok').sum():,}/{len(summary):,}")
+    print(f"→ Đã lưu tổng kết vào file: {output_file}")
+
+    print("\n" + "=" * 50)
+    print(f"{Fore.GREEN}Hoàn thành xử lý hàng loạt!{Style.RESET_ALL}")
+
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Xử lý hàng loạt các bộ dữ liệu trong output/")
+    parser.add_argument('--stages', default=','.join(DEFAULT_STAGES),
+                        help="Các bước cần chạy, cách nhau bởi dấu phẩy")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Số tiến trình tối đa (mặc định: số nhân CPU)")
+    parser.add_argument('--memory-mb', type=int, default=None,
+                        help="Giới hạn bộ nhớ ước lượng (MB, mặc định: 80%% RAM còn trống)")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"Bước không hợp lệ: {', '.join(unknown)}")
+
+    memory_limit = args.memory_mb * 1024 * 1024 if args.memory_mb else None
+    run_batch(stages, args.workers, memory_limit)
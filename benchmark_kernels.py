@@ -0,0 +1,72 @@
+import time
+import argparse
+import numpy as np
+from colorama import init, Fore, Style
+import kernels
+
+init()
+
+def make_inputs(rows, seed=42):
+    """Sinh dữ liệu giống genarate_data (có 10% giá NaN)"""
+    rng = np.random.default_rng(seed)
+    price = np.round(rng.uniform(1.0, 100.0, rows), 2)
+    price[rng.choice(rows, rows // 10, replace=False)] = np.nan
+    quantity = rng.integers(1, 10, rows).astype(np.float64)
+    discount = np.round(rng.uniform(0.0, 0.5, rows), 2)
+    total = np.round(quantity * price * (1 - discount), 2)
+    codes = np.sort(rng.integers(0, max(rows // 36, 1), rows))
+    counts = rng.integers(1, 60, rows)
+    return price, quantity, discount, total, codes, counts
+
+def run_kernels(inputs):
+    """Chạy mọi kernel một lần, trả về (kết quả, thời gian) theo tên"""
+    price, quantity, discount, total, codes, counts = inputs
+    values = np.nan_to_num(total)
+    cases = {
+        'total_amount': lambda: kernels.total_amount(quantity, price, discount),
+        'invalid_rows': lambda: kernels.invalid_rows(price, quantity, discount, total),
+        'declining_starts': lambda: kernels.declining_starts(codes, counts),
+        'flag_outside': lambda: kernels.flag_outside(values, 20.0, 600.0),
+        'flag_zscore': lambda: kernels.flag_zscore(values, values.mean(), values.std(), 3),
+    }
+    results = {}
+    for name, func in cases.items():
+        func()  # Lần đầu: biên dịch (Numba) / làm nóng bộ nhớ đệm
+        start = time.perf_counter()
+        output = func()
+        results[name] = (output, time.perf_counter() - start)
+    return results
+
+def benchmark(rows=10_000_000, backends=('numpy', 'numba')):
+    """So sánh thời gian và kết quả của các backend"""
+    print(f"\n{Fore.GREEN}So sánh backend kernel ({rows:,} dòng){Style.RESET_ALL}")
+    print("=" * 50)
+
+    inputs = make_inputs(rows)
+    timings = {}
+    for backend in backends:
+        try:
+            kernels.set_backend(backend)
+        except ImportError as e:
+            print(f"{Fore.YELLOW}→ Bỏ qua {backend}: {e}{Style.RESET_ALL}")
+            continue
+        timings[backend] = run_kernels(inputs)
+    kernels.set_backend('auto')
+
+    names = next(iter(timings.values())).keys() if timings else []
+    print(f"\n{'kernel':<20}" + ''.join(f"{b:>12}" for b in timings) + f"{'giống nhau':>12}")
+    for name in names:
+        outputs = [timings[b][name][0] for b in timings]
+        same = all(np.array_equal(outputs[0], o, equal_nan=o.dtype.kind == 'f') for o in outputs[1:])
+        print(f"{name:<20}" + ''.join(f"{timings[b][name][1] * 1000:>10.1f}ms" for b in timings) +
+              f"{'✓' if same else '✗':>12}")
+    return timings
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="So sánh backend NumPy và Numba của kernels.py")
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--backend', choices=['both', 'numpy', 'numba'], default='both')
+    args = parser.parse_args()
+
+    backends = ('numpy', 'numba') if args.backend == 'both' else (args.backend,)
+    benchmark(args.rows, backends)
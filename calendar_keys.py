@@ -0,0 +1,71 @@
+import numpy as np
+
+# Số nano giây trong một ngày
+NS_PER_DAY = 86_400_000_000_000
+
+def _timestamps_ns(dates):
+    """Lấy mốc thời gian dạng int64 (nano giây từ 1970-01-01)"""
+    return np.asarray(dates, dtype='datetime64[ns]').view(np.int64)
+
+def _civil_from_days(days):
+    """Chuyển số ngày từ 1970-01-01 thành (năm, tháng, ngày) theo lịch Gregory"""
+    z = days + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = np.where(mp < 10, mp + 3, mp - 9)
+    year = yoe + era * 400 + (month <= 2)
+    return year, month, day
+
+def _days_from_jan1(year):
+    """Số ngày từ 1970-01-01 tới ngày 1/1 của các năm cho trước"""
+    y = year - 1
+    era = y // 400
+    yoe = y - era * 400
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + 306
+    return era * 146097 + doe - 719468
+
+def calendar_keys(dates):
+    """Tính các khóa lịch dạng số nguyên trong một lần duyệt
+
+    Trả về dict gồm:
+    - day: số ngày từ 1970-01-01
+    - month: số tháng từ 1970-01 (trùng ordinal của Period tháng)
+    - iso_year, iso_week: năm và tuần theo chuẩn ISO 8601
+    """
+    days = _timestamps_ns(dates) // NS_PER_DAY
+    year, month, _ = _civil_from_days(days)
+
+    # Tuần ISO: tuần chứa ngày thứ Năm thuộc về năm của ngày thứ Năm đó
+    weekday = (days + 3) % 7  # Thứ Hai = 0, 1970-01-01 là thứ Năm
+    thursday = days - weekday + 3
+    iso_year, _, _ = _civil_from_days(thursday)
+    iso_week = (thursday - _days_from_jan1(iso_year)) // 7 + 1
+
+    return {
+        'day': days,
+        'month': (year - 1970) * 12 + (month - 1),
+        'iso_year': iso_year,
+        'iso_week': iso_week
+    }
+
+def day_to_datetime(day_keys):
+    """Chuyển khóa ngày về datetime64"""
+    return np.asarray(day_keys, dtype=np.int64).astype('datetime64[D]')
+
+def month_label(month_key):
+    """Nhãn 'YYYY-MM' của một khóa tháng"""
+    year, month = divmod(int(month_key), 12)
+    return f"{year + 1970}-{month + 1:02d}"
+
+def week_key(iso_year, iso_week):
+    """Khóa tuần số nguyên YYYYWW (tăng dần theo thời gian)"""
+    return np.asarray(iso_year, dtype=np.int64) * 100 + np.asarray(iso_week, dtype=np.int64)
+
+def week_label(week_key):
+    """Nhãn 'YYYY-Www' của một khóa tuần"""
+    year, week = divmod(int(week_key), 100)
+    return f"{year}-W{week:02d}"
@@ -0,0 +1,177 @@
+import os
+import io
+import json
+import numpy as np
+import pandas as pd
+from datasets import DTYPES, FAST_ENGINE, dataset_path, parse_order_dates
+import kernels
+
+# Tăng khi định dạng file thống kê thay đổi để tạo lại file cũ
+STATS_VERSION = 2
+
+# Số dòng của mỗi khối (theo thứ tự trong file)
+CHUNK_ROWS = 100_000
+
+# Các cột số được thống kê
+STATS_COLUMNS = ['price', 'quantity', 'discount', 'total_amount']
+
+# Các cột phải đầy đủ để một dòng được dùng trong phân tích / phát hiện bất thường
+CLEAN_COLUMNS = ['customer_id', 'order_date', 'price', 'quantity', 'discount']
+
+# Phân vị chính xác của toàn bộ dữ liệu và phân vị xấp xỉ (sketch) của từng khối
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+SKETCH = np.linspace(0, 1, 21).round(2).tolist()
+
+def stats_path(student_id):
+    """Đường dẫn file thống kê đi kèm của một bộ dữ liệu"""
+    return os.path.join('output', f'stats_{student_id}.json')
+
+def _signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def column_summary(values, quantiles=()):
+    """Số dòng, số giá trị thiếu, min, max, trung bình, phương sai (ddof=0) và phân vị
+
+    Bỏ qua NaN như pandas; phân vị nội suy tuyến tính giống Series.quantile.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = values[~np.isnan(values)]
+    summary = {'count': int(len(valid)), 'nulls': int(len(values) - len(valid))}
+    if len(valid):
+        summary.update(min=float(valid.min()), max=float(valid.max()),
+                       mean=float(valid.mean()), var=float(valid.var()))
+    else:
+        summary.update(min=None, max=None, mean=None, var=None)
+    if len(quantiles):
+        points = np.quantile(valid, quantiles) if len(valid) else [None] * len(quantiles)
+        summary['quantiles'] = {str(q): None if v is None else float(v)
+                                for q, v in zip(quantiles, points)}
+    return summary
+
+def _chunk_layout(path, rows, chunk_rows):
+    """Tên cột và vị trí byte (bắt đầu, kết thúc) của từng khối dòng trong file CSV"""
+    starts = list(range(0, rows, chunk_rows))
+    targets = [start + 1 for start in starts]  # Dòng 0 là tiêu đề
+    offsets = []
+    seen = 0
+    with open(path, 'rb') as f:
+        header = f.readline().decode('utf-8').strip().split(',')
+        f.seek(0)
+        position = 0
+        for block in iter(lambda: f.read(16 * 1024 * 1024), b''):
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+            # Dòng L bắt đầu ngay sau ký tự xuống dòng thứ L (đếm từ 1)
+            while len(offsets) < len(targets) and targets[len(offsets)] <= seen + len(newlines):
+                offsets.append(position + int(newlines[targets[len(offsets)] - seen - 1]) + 1)
+            seen += len(newlines)
+            position += len(block)
+    ends = offsets[1:] + [position]
+    return header, list(zip(starts, offsets, ends))
+
+def build_stats(df, input_file, chunk_rows=CHUNK_ROWS):
+    """Tính thống kê toàn bộ dữ liệu và từng khối từ DataFrame gốc (theo thứ tự file)
+
+    total_amount luôn được tính lại từ quantity, price và discount (kể cả khi
+    file có sẵn cột này), giống giá trị mà detect_anomalies dùng để đánh dấu.
+    """
+    columns = {c: df[c].to_numpy(dtype=np.float64) for c in STATS_COLUMNS[:-1]}
+    columns['total_amount'] = np.asarray(
+        kernels.total_amount(df['quantity'], df['price'], df['discount']), dtype=np.float64)
+
+    header, layout = _chunk_layout(input_file, len(df), chunk_rows)
+    chunks = []
+    for start, offset, end in layout:
+        stop = min(start + chunk_rows, len(df))
+        chunks.append({
+            'start': start,
+            'rows': stop - start,
+            'offset': offset,
+            'end': end,
+            'columns': {c: column_summary(v[start:stop], SKETCH) for c, v in columns.items()}
+        })
+
+    return {
+        'version': STATS_VERSION,
+        'signature': _signature(input_file),
+        'header': header,
+        'rows': len(df),
+        'complete_rows': int(df[CLEAN_COLUMNS].notna().all(axis=1).sum()),
+        'columns': {c: column_summary(v, QUANTILES) for c, v in columns.items()},
+        'chunks': chunks
+    }
+
+def write_stats(student_id, df):
+    """Tạo và lưu file thống kê đi kèm từ DataFrame đang có trong bộ nhớ"""
+    output_file = stats_path(student_id)
+    stats = build_stats(df, dataset_path(student_id))
+    tmp_file = f'{output_file}.{os.getpid()}.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(stats, f)
+    os.replace(tmp_file, output_file)
+    print(f"→ Đã lưu thống kê cột ({len(stats['chunks'])} khối): {output_file}")
+    return stats
+
+def load_stats(student_id, load_df=None):
+    """Đọc file thống kê đi kèm nếu còn khớp với file giao dịch (kích thước, thời gian sửa)
+
+    Nếu chưa có hoặc đã cũ: tạo lại từ load_df() khi được truyền, ngược lại trả về None.
+    """
+    try:
+        with open(stats_path(student_id), encoding='utf-8') as f:
+            stats = json.load(f)
+        if (stats.get('version') == STATS_VERSION and
+                stats['signature'] == _signature(dataset_path(student_id))):
+            return stats
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if load_df is None:
+        return None
+    return write_stats(student_id, load_df())
+
+def covers_clean_rows(stats):
+    """Thống kê total_amount có đúng bằng tập dòng đầy đủ (dòng dùng để phân tích) không"""
+    return (stats is not None and
+            stats['complete_rows'] == stats['columns']['total_amount']['count'])
+
+def chunks_outside(stats, column, lower, upper):
+    """Chỉ số các khối có thể chứa giá trị < lower hoặc > upper (theo min/max của khối)
+
+    Ngưỡng được nới thêm một khoảng rất nhỏ để không bỏ sót do sai số làm tròn.
+    """
+    margin = 1e-9 * max(1.0, abs(lower), abs(upper))
+    selected = []
+    for i, chunk in enumerate(stats['chunks']):
+        summary = chunk['columns'][column]
+        if summary['count'] and (summary['min'] <= lower + margin or summary['max'] >= upper - margin):
+            selected.append(i)
+    return selected
+
+def read_chunks(input_file, stats, indices, usecols=None):
+    """Chỉ đọc các khối được chọn của file giao dịch (nhảy thẳng tới vị trí byte)
+
+    Index của kết quả là số thứ tự dòng trong file, giống khi đọc toàn bộ file.
+    """
+    header = stats['header']
+    usecols = usecols or header
+    dtype = {c: t for c, t in DTYPES.items() if c in header}
+
+    frames = []
+    with open(input_file, 'rb') as f:
+        for i in indices:
+            chunk = stats['chunks'][i]
+            f.seek(chunk['offset'])
+            data = io.BytesIO(f.read(chunk['end'] - chunk['offset']))
+            # Lọc cột sau khi đọc: engine pyarrow không nhận usecols khi header=None
+            frame = pd.read_csv(data, header=None, names=header, dtype=dtype,
+                                engine=FAST_ENGINE)[usecols]
+            frame.index = pd.RangeIndex(chunk['start'], chunk['start'] + len(frame))
+            frames.append(frame)
+
+    if not frames:
+        df = pd.DataFrame({c: pd.Series(dtype=dtype.get(c, object)) for c in usecols})
+    else:
+        df = pd.concat(frames)
+    df['order_date'] = parse_order_dates(df['order_date'])
+    return df
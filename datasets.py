@@ -0,0 +1,81 @@
+import os
+import pandas as pd
+from colorama import init, Fore, Style
+
+# Engine pyarrow đọc CSV đa luồng; nếu chưa cài thì dùng engine C mặc định
+try:
+    import pyarrow  # noqa: F401
+    FAST_ENGINE = 'pyarrow'
+except ImportError:
+    FAST_ENGINE = 'c'
+
+init()
+
+# Kiểu dữ liệu và định dạng thời gian của file giao dịch
+DTYPES = {
+    'customer_id': str,
+    'price': float,
+    'quantity': int,
+    'discount': float
+}
+ORDER_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def dataset_path(student_id):
+    """Đường dẫn file giao dịch của một bộ dữ liệu"""
+    return os.path.join('output', f'transactions_{student_id}.csv')
+
+def find_datasets():
+    """Tìm mã của tất cả bộ dữ liệu transactions_*.csv trong thư mục output"""
+    files = sorted(f for f in os.listdir('output')
+                   if f.startswith('transactions_') and f.endswith('.csv'))
+    return [f[len('transactions_'):-len('.csv')] for f in files]
+
+def list_available_files():
+    """Liệt kê các file dữ liệu có sẵn"""
+    datasets = find_datasets()
+    if not datasets:
+        print(f"\n{Fore.RED}Không tìm thấy file dữ liệu nào trong thư mục output!{Style.RESET_ALL}")
+        return None
+
+    print(f"\n{Fore.YELLOW}Danh sách file dữ liệu:{Style.RESET_ALL}")
+    for i, student_id in enumerate(datasets, 1):
+        file_path = dataset_path(student_id)
+        file_size = os.path.getsize(file_path) / (1024 * 1024)  # Convert to MB
+        print(f"{i}. {os.path.basename(file_path)} ({file_size:.1f} MB)")
+
+    while True:
+        try:
+            choice = input(f"\n{Fore.YELLOW}Chọn file để phân tích (1-{len(datasets)}): {Style.RESET_ALL}")
+            idx = int(choice) - 1
+            if 0 <= idx < len(datasets):
+                return datasets[idx]
+        except ValueError:
+            pass
+        print(f"{Fore.RED}Lựa chọn không hợp lệ!{Style.RESET_ALL}")
+
+def parse_order_dates(values):
+    """Chuyển cột order_date sang datetime theo định dạng cố định (không đoán từng dòng)"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    try:
+        return pd.to_datetime(values, format=ORDER_DATE_FORMAT)
+    except ValueError:
+        return pd.to_datetime(values)
+
+def read_transactions(input_file, usecols=None, engine=None):
+    """Đọc file giao dịch bằng engine đa luồng (pyarrow) nếu có
+
+    order_date được chuyển theo ORDER_DATE_FORMAT; nếu engine pyarrow không đọc
+    được file thì đọc lại bằng engine C.
+    """
+    engine = engine or FAST_ENGINE
+    dtype = {c: t for c, t in DTYPES.items() if usecols is None or c in usecols}
+    try:
+        df = pd.read_csv(input_file, dtype=dtype, usecols=usecols, engine=engine)
+    except ValueError:
+        if engine == 'c':
+            raise
+        df = pd.read_csv(input_file, dtype=dtype, usecols=usecols, engine='c')
+
+    df['order_date'] = parse_order_dates(df['order_date'])
+    return df
@@ -2,35 +2,17 @@ import sys
 import os
 import pandas as pd
 import numpy as np
-from scipy import stats
 from colorama import init, Fore, Style
+from datasets import list_available_files, read_transactions
+import session_cache
+import kernels
+import column_stats
+from stage_cache import cached_stage
+from calendar_keys import calendar_keys
+from segment_stats import segment_codes, segment_moments, segment_quantiles
 
 init()
 
-def list_available_files():
-    """Liệt kê các file dữ liệu có sẵn"""
-    files = [f for f in os.listdir('output') if f.startswith('transactions_')]
-    if not files:
-        print(f"\n{Fore.RED}Không tìm thấy file dữ liệu nào trong thư mục output!{Style.RESET_ALL}")
-        return None
-
-    print(f"\n{Fore.YELLOW}Danh sách file dữ liệu:{Style.RESET_ALL}")
-    for i, file in enumerate(files, 1):
-        file_path = os.path.join('output', file)
-        file_size = os.path.getsize(file_path) / (1024 * 1024)  # Convert to MB
-        print(f"{i}. {file} ({file_size:.1f} MB)")
-
-    while True:
-        try:
-            choice = input(f"\n{Fore.YELLOW}Chọn file để phân tích (1-{len(files)}): {Style.RESET_ALL}")
-            idx = int(choice) - 1
-            if 0 <= idx < len(files):
-                return files[idx].replace('transactions_', '').replace('.csv', '')
-        except ValueError:
-            pass
-        print(f"{Fore.RED}Lựa chọn không hợp lệ!{Style.RESET_ALL}")
-
-
 def load_data(student_id):
     """Đọc và chuẩn bị dữ liệu"""
     print(f"{Fore.BLUE}[1/4] Đọc dữ liệu{Style.RESET_ALL}")
@@ -38,89 +20,272 @@ def load_data(student_id):
     input_file = os.path.join('output', f'transactions_{student_id}.csv')
     print(f"File: {input_file}")
 
-    df = pd.read_csv(input_file,
-                    dtype={
-                        'customer_id': str,
-                        'price': float,
-                        'quantity': int,
-                        'discount': float
-                    },
-                    usecols=['customer_id', 'order_date', 'price', 'quantity', 'discount'],
-                    parse_dates=['order_date'])
+    columns = ['customer_id', 'order_date', 'price', 'quantity', 'discount']
+
+    def read():
+        df = read_transactions(input_file, usecols=columns)
 
-    # Chỉ lấy dữ liệu tốt (không có NaN)
-    df = df.dropna()
+        # Chỉ lấy dữ liệu tốt (không có NaN)
+        df = df.dropna()
 
-    # Tạo cột total_amount nếu chưa có
-    if 'total_amount' not in df.columns:
-        df['total_amount'] = round(df['quantity'] * df['price'] * (1 - df['discount']), 2)
+        # Tạo cột total_amount nếu chưa có
+        if 'total_amount' not in df.columns:
+            df['total_amount'] = kernels.total_amount(df['quantity'], df['price'], df['discount'])
+        return df
+
+    # Dùng lại dữ liệu đã làm sạch trong phiên (phân tích/phân tích nâng cao) nếu có,
+    # chỉ lấy các cột cần khi tra cứu để không giữ thêm một bản nữa trong phiên.
+    # total_amount luôn tính lại như khi đọc file (bỏ qua cột total_amount có sẵn trong file)
+    df = session_cache.lookup(student_id, 'clean')
+    if df is not None:
+        df = df[columns].assign(
+            total_amount=kernels.total_amount(df['quantity'], df['price'], df['discount']))
+    else:
+        df = session_cache.cached_frame(student_id, 'detect', read)
 
     print(f"→ Đã đọc: {len(df):,} dòng")
     return df
 
-def detect_zscore_anomalies(df, threshold=3):
-    """Phát hiện bất thường bằng Z-score"""
-    print(f"\n{Fore.BLUE}[2/4] Phát hiện bất thường bằng Z-score{Style.RESET_ALL}")
+def candidate_bounds(stats, threshold=3, multiplier=5):
+    """Khoảng [lower, upper] mà mọi giá trị bên trong không bị phương pháp nào đánh dấu"""
+    total = stats['columns']['total_amount']
+    std = np.sqrt(total['var'])
+    q1, q3 = total['quantiles']['0.25'], total['quantiles']['0.75']
+    iqr = q3 - q1
+    lower = max(total['mean'] - threshold * std, q1 - 1.5 * iqr)
+    upper = min(total['mean'] + threshold * std, q3 + 1.5 * iqr,
+                total['quantiles']['0.5'] * multiplier)
+    return lower, upper
+
+def load_candidates(student_id, stats, threshold=3, multiplier=5):
+    """Chỉ đọc các khối có thể chứa giao dịch bất thường (theo min/max trong file thống kê)"""
+    print(f"{Fore.BLUE}[1/4] Đọc dữ liệu{Style.RESET_ALL}")
 
-    z_scores = stats.zscore(df['total_amount'])
-    zscore_anomalies = df[abs(z_scores) > threshold].copy()
+    input_file = os.path.join('output', f'transactions_{student_id}.csv')
+    print(f"File: {input_file}")
 
-    print(f"→ Số giao dịch bất thường (Z-score > {threshold}): {len(zscore_anomalies):,}")
-    print(f"→ Tỷ lệ: {(len(zscore_anomalies)/len(df))*100:.2f}%")
+    columns = ['customer_id', 'order_date', 'price', 'quantity', 'discount']
+    lower, upper = candidate_bounds(stats, threshold, multiplier)
+    chunks = column_stats.chunks_outside(stats, 'total_amount', lower, upper)
+    df = column_stats.read_chunks(input_file, stats, chunks, usecols=columns).dropna()
+    df['total_amount'] = kernels.total_amount(df['quantity'], df['price'], df['discount'])
 
-    return zscore_anomalies
+    print(f"→ Đọc {len(chunks)}/{len(stats['chunks'])} khối ({len(df):,} dòng), "
+          f"bỏ qua các khối nằm trọn trong [${lower:.2f}, ${upper:.2f}]")
+    return df
 
-def detect_iqr_anomalies(df):
-    """Phát hiện bất thường bằng IQR"""
-    print(f"\n{Fore.BLUE}[3/4] Phát hiện bất thường bằng IQR{Style.RESET_ALL}")
+def group_codes(df, by):
+    """Mã nhóm để tính ngưỡng riêng: 'customer' hoặc 'customer_month'"""
+    keys = [df['customer_id']]
+    if by == 'customer_month':
+        keys.append(calendar_keys(df['order_date'])['month'])
+    elif by != 'customer':
+        raise ValueError(f"Cách nhóm không hợp lệ: {by}")
+    return segment_codes(keys)
+
+def group_stats(df, by):
+    """Thống kê theo nhóm dùng chung cho cả ba phương pháp (mã nhóm và tứ phân vị chỉ tính một lần)"""
+    values = df['total_amount'].to_numpy(dtype=np.float64)
+    codes, n = group_codes(df, by)
+    counts, mean, std = segment_moments(values, codes, n)
+    quartiles = segment_quantiles(values, codes, n, [0.25, 0.5, 0.75])
+    return {'codes': codes, 'counts': counts, 'mean': mean, 'std': std, 'quartiles': quartiles}
+
+def group_summary(counts, min_rows):
+    """Số nhóm và số nhóm ít dữ liệu phải dùng ngưỡng chung"""
+    return len(counts), int((counts < min_rows).sum())
+
+def print_group_summary(groups):
+    """In số nhóm và số nhóm ít dữ liệu phải dùng ngưỡng chung"""
+    n_groups, n_small = groups
+    print(f"→ Ngưỡng theo nhóm: {n_groups:,} nhóm, "
+          f"{n_small:,} nhóm ít dữ liệu dùng ngưỡng chung")
+
+def detect_zscore_anomalies(df, threshold=3, by=None, min_rows=30, stats=None, groups=None):
+    """Phát hiện bất thường bằng Z-score
+
+    by=None dùng một ngưỡng chung; by='customer' hoặc 'customer_month' tính
+    trung bình/độ lệch chuẩn riêng cho từng nhóm, nhóm có ít hơn min_rows dòng
+    dùng thống kê chung. stats (file thống kê đi kèm) cung cấp thống kê chung
+    thay vì tính trên df, khi đó df có thể chỉ gồm các khối cần kiểm tra.
+    groups là kết quả group_stats(df, by) đã tính sẵn (tính lại nếu không truyền).
+    Trả về (các giao dịch bất thường, báo cáo để in bằng print_zscore_report).
+    """
+    values = df['total_amount'].to_numpy(dtype=np.float64)
+    if stats is None:
+        mean, std, rows = values.mean(), values.std(), len(df)
+    else:
+        total = stats['columns']['total_amount']
+        mean, std, rows = total['mean'], np.sqrt(total['var']), total['count']
+    report = {'threshold': threshold, 'rows': rows, 'groups': None}
+    if by is not None:
+        groups = groups or group_stats(df, by)
+        codes, counts = groups['codes'], groups['counts']
+        small = counts < min_rows
+        group_mean = np.where(small, mean, groups['mean'])
+        group_std = np.where(small, std, groups['std'])
+        report['groups'] = group_summary(counts, min_rows)
+        mean, std = group_mean[codes], group_std[codes]
+    zscore_anomalies = df[kernels.flag_zscore(values, mean, std, threshold)].copy()
+    report['count'] = len(zscore_anomalies)
+
+    return zscore_anomalies, report
+
+def print_zscore_report(report):
+    """In kết quả phát hiện bất thường bằng Z-score"""
+    print(f"\n{Fore.BLUE}[2/4] Phát hiện bất thường bằng Z-score{Style.RESET_ALL}")
 
-    Q1 = df['total_amount'].quantile(0.25)
-    Q3 = df['total_amount'].quantile(0.75)
+    if report['groups'] is not None:
+        print_group_summary(report['groups'])
+    print(f"→ Số giao dịch bất thường (Z-score > {report['threshold']}): {report['count']:,}")
+    print(f"→ Tỷ lệ: {(report['count']/report['rows'])*100:.2f}%")
+
+def detect_iqr_anomalies(df, by=None, min_rows=30, stats=None, groups=None):
+    """Phát hiện bất thường bằng IQR (by, min_rows, stats, groups như detect_zscore_anomalies)"""
+    if stats is None:
+        Q1 = df['total_amount'].quantile(0.25)
+        Q3 = df['total_amount'].quantile(0.75)
+        rows = len(df)
+    else:
+        total = stats['columns']['total_amount']
+        Q1, Q3 = total['quantiles']['0.25'], total['quantiles']['0.75']
+        rows = total['count']
     IQR = Q3 - Q1
 
     lower_bound = Q1 - 1.5 * IQR
     upper_bound = Q3 + 1.5 * IQR
+    report = {'rows': rows, 'groups': None, 'lower': lower_bound, 'upper': upper_bound}
+
+    values = df['total_amount'].to_numpy(dtype=np.float64)
+    if by is not None:
+        # Cận theo từng nhóm, nhóm ít dữ liệu giữ cận chung
+        groups = groups or group_stats(df, by)
+        codes, counts, quartiles = groups['codes'], groups['counts'], groups['quartiles']
+        group_iqr = quartiles[:, 2] - quartiles[:, 0]
+        small = counts < min_rows
+        lower = np.where(small, lower_bound, quartiles[:, 0] - 1.5 * group_iqr)
+        upper = np.where(small, upper_bound, quartiles[:, 2] + 1.5 * group_iqr)
+        report['groups'] = group_summary(counts, min_rows)
+        lower_bound, upper_bound = lower[codes], upper[codes]
+
+    iqr_anomalies = df[kernels.flag_outside(values, lower_bound, upper_bound)].copy()
+    report['count'] = len(iqr_anomalies)
+
+    return iqr_anomalies, report
+
+def print_iqr_report(report):
+    """In kết quả phát hiện bất thường bằng IQR"""
+    print(f"\n{Fore.BLUE}[3/4] Phát hiện bất thường bằng IQR{Style.RESET_ALL}")
 
-    iqr_anomalies = df[
-        (df['total_amount'] < lower_bound) |
-        (df['total_amount'] > upper_bound)
-    ].copy()
+    if report['groups'] is not None:
+        print_group_summary(report['groups'])
+    print(f"→ Số giao dịch bất thường (ngoài khoảng IQR): {report['count']:,}")
+    print(f"→ Tỷ lệ: {(report['count']/report['rows'])*100:.2f}%")
+    if report['groups'] is None:
+        print(f"\nPhạm vi bình thường:")
+        print(f"→ Cận dưới: ${report['lower']:.2f}")
+        print(f"→ Cận trên: ${report['upper']:.2f}")
+
+def detect_median_anomalies(df, multiplier=5, by=None, min_rows=30, stats=None, groups=None):
+    """Phát hiện bất thường dựa trên trung vị (by, min_rows, stats, groups như detect_zscore_anomalies)"""
+    if stats is None:
+        median, rows = df['total_amount'].median(), len(df)
+    else:
+        total = stats['columns']['total_amount']
+        median, rows = total['quantiles']['0.5'], total['count']
+    limit = median * multiplier
+    report = {'median': median, 'multiplier': multiplier, 'rows': rows, 'groups': None}
+
+    values = df['total_amount'].to_numpy(dtype=np.float64)
+    if by is not None:
+        groups = groups or group_stats(df, by)
+        codes, counts = groups['codes'], groups['counts']
+        group_median = groups['quartiles'][:, 1]
+        small = counts < min_rows
+        report['groups'] = group_summary(counts, min_rows)
+        limit = np.where(small, median, group_median)[codes] * multiplier
+
+    median_anomalies = df[kernels.flag_outside(values, upper=limit)].copy()
+    report['count'] = len(median_anomalies)
+
+    return median_anomalies, report
+
+def print_median_report(report):
+    """In kết quả phát hiện bất thường dựa trên trung vị"""
+    print(f"\n{Fore.BLUE}[4/4] Phát hiện bất thường dựa trên trung vị{Style.RESET_ALL}")
 
-    print(f"→ Số giao dịch bất thường (ngoài khoảng IQR): {len(iqr_anomalies):,}")
-    print(f"→ Tỷ lệ: {(len(iqr_anomalies)/len(df))*100:.2f}%")
-    print(f"\nPhạm vi bình thường:")
-    print(f"→ Cận dưới: ${lower_bound:.2f}")
-    print(f"→ Cận trên: ${upper_bound:.2f}")
+    if report['groups'] is not None:
+        print_group_summary(report['groups'])
+    print(f"→ Trung vị total_amount: ${report['median']:.2f}")
+    if report['groups'] is None:
+        print(f"→ Ngưỡng phát hiện: ${report['median'] * report['multiplier']:.2f}")
+    print(f"→ Số giao dịch bất thường (> {report['multiplier']} lần trung vị): {report['count']:,}")
+    print(f"→ Tỷ lệ: {(report['count']/report['rows'])*100:.2f}%")
 
-    return iqr_anomalies
+def analyze_and_save_anomalies(df, method_name, anomalies, report):
+    """Thống kê về các giao dịch bất thường (thêm vào report) và đánh dấu phương pháp phát hiện"""
+    report['amount'] = anomalies['total_amount'].agg(['mean', 'min', 'max']).to_dict()
 
-def detect_median_anomalies(df, multiplier=5):
-    """Phát hiện bất thường dựa trên trung vị"""
-    print(f"\n{Fore.BLUE}[4/4] Phát hiện bất thường dựa trên trung vị{Style.RESET_ALL}")
+    # Thêm cột để đánh dấu phương pháp phát hiện
+    anomalies['detection_method'] = method_name
 
-    median = df['total_amount'].median()
-    median_anomalies = df[df['total_amount'] > median * multiplier].copy()
+    return anomalies
 
-    print(f"→ Trung vị total_amount: ${median:.2f}")
-    print(f"→ Ngưỡng phát hiện: ${median * multiplier:.2f}")
-    print(f"→ Số giao dịch bất thường (> {multiplier} lần trung vị): {len(median_anomalies):,}")
-    print(f"→ Tỷ lệ: {(len(median_anomalies)/len(df))*100:.2f}%")
+def print_anomaly_stats(method_name, report):
+    """Hiển thị thống kê về các giao dịch bất thường của một phương pháp"""
+    amount = report['amount']
+    print(f"\n{Fore.YELLOW}Thống kê giao dịch bất thường ({method_name}):{Style.RESET_ALL}")
+    print(f"→ Total amount trung bình: ${amount['mean']:.2f}")
+    print(f"→ Total amount thấp nhất: ${amount['min']:.2f}")
+    print(f"→ Total amount cao nhất: ${amount['max']:.2f}")
+
+def print_detection_reports(reports):
+    """In báo cáo của các phương pháp (cả khi tính mới lẫn khi dùng kết quả đã lưu)"""
+    print_zscore_report(reports['Z-score'])
+    print_iqr_report(reports['IQR'])
+    print_median_report(reports['Median'])
+    for method_name, report in reports.items():
+        print_anomaly_stats(method_name, report)
+
+def find_anomalies(student_id, threshold=3, multiplier=5, by=None):
+    """Đọc dữ liệu và gộp kết quả của các phương pháp phát hiện bất thường
+
+    Trả về (các giao dịch bất thường, báo cáo của từng phương pháp cho print_detection_reports).
+    """
+    # 1. Đọc dữ liệu: với ngưỡng chung, thống kê lấy từ file thống kê đi kèm và
+    #    chỉ đọc các khối có thể chứa giao dịch bất thường nếu dữ liệu chưa có trong phiên
+    stats = column_stats.load_stats(student_id) if by is None else None
+    if not column_stats.covers_clean_rows(stats):
+        stats = None
+    in_session = (session_cache.contains(student_id, 'detect') or
+                  session_cache.contains(student_id, 'clean'))
+    if stats is not None and not in_session:
+        df = load_candidates(student_id, stats, threshold, multiplier)
+    else:
+        df = load_data(student_id)
 
-    return median_anomalies
+    # 2. Phát hiện bất thường bằng các phương pháp khác nhau
+    #    (mã nhóm và thống kê theo nhóm tính một lần cho cả ba phương pháp)
+    groups = group_stats(df, by) if by is not None else None
+    zscore_anomalies, zscore_report = detect_zscore_anomalies(df, threshold, by, stats=stats, groups=groups)
+    iqr_anomalies, iqr_report = detect_iqr_anomalies(df, by, stats=stats, groups=groups)
+    median_anomalies, median_report = detect_median_anomalies(df, multiplier, by, stats=stats, groups=groups)
+    reports = {'Z-score': zscore_report, 'IQR': iqr_report, 'Median': median_report}
 
-def analyze_and_save_anomalies(df, method_name, anomalies):
-    """Phân tích và hiển thị thống kê về các giao dịch bất thường"""
-    print(f"\n{Fore.YELLOW}Thống kê giao dịch bất thường ({method_name}):{Style.RESET_ALL}")
-    print(f"→ Total amount trung bình: ${anomalies['total_amount'].mean():.2f}")
-    print(f"→ Total amount thấp nhất: ${anomalies['total_amount'].min():.2f}")
-    print(f"→ Total amount cao nhất: ${anomalies['total_amount'].max():.2f}")
+    # 3. Phân tích và gộp kết quả
+    all_anomalies = pd.concat([
+        analyze_and_save_anomalies(df, "Z-score", zscore_anomalies, zscore_report),
+        analyze_and_save_anomalies(df, "IQR", iqr_anomalies, iqr_report),
+        analyze_and_save_anomalies(df, "Median", median_anomalies, median_report)
+    ])
 
-    # Thêm cột để đánh dấu phương pháp phát hiện
-    anomalies['detection_method'] = method_name
+    # 4. Loại bỏ các giao dịch trùng lặp và sắp xếp theo total_amount
+    all_anomalies = all_anomalies.drop_duplicates(subset=['customer_id', 'order_date', 'total_amount'])
+    all_anomalies = all_anomalies.sort_values('total_amount', ascending=False)
 
-    return anomalies
+    return all_anomalies, reports
 
-def detect_anomalies(student_id=None):
+def detect_anomalies(student_id=None, threshold=3, multiplier=5, by=None):
     print(f"\n{Fore.GREEN}Bắt đầu phát hiện giao dịch bất thường...{Style.RESET_ALL}")
     print("=" * 50)
 
@@ -130,24 +295,14 @@ def detect_anomalies(student_id=None):
         if student_id is None:
             return None
 
-    # 1. Đọc dữ liệu
-    df = load_data(student_id)
-
-    # 2. Phát hiện bất thường bằng các phương pháp khác nhau
-    zscore_anomalies = detect_zscore_anomalies(df)
-    iqr_anomalies = detect_iqr_anomalies(df)
-    median_anomalies = detect_median_anomalies(df)
-
-    # 3. Phân tích và gộp kết quả
-    all_anomalies = pd.concat([
-        analyze_and_save_anomalies(df, "Z-score", zscore_anomalies),
-        analyze_and_save_anomalies(df, "IQR", iqr_anomalies),
-        analyze_and_save_anomalies(df, "Median", median_anomalies)
-    ])
+    # 1-4. Phát hiện bất thường (dùng lại kết quả nếu file và tham số không đổi)
+    input_file = os.path.join('output', f'transactions_{student_id}.csv')
+    params = {'threshold': threshold, 'multiplier': multiplier, 'by': by}
+    all_anomalies, reports = cached_stage('detect', input_file, params,
+                                          lambda: find_anomalies(student_id, threshold, multiplier, by))
 
-    # 4. Loại bỏ các giao dịch trùng lặp và sắp xếp theo total_amount
-    all_anomalies = all_anomalies.drop_duplicates(subset=['customer_id', 'order_date', 'total_amount'])
-    all_anomalies = all_anomalies.sort_values('total_amount', ascending=False)
+    # In kết quả (cả khi tính mới lẫn khi dùng kết quả đã lưu)
+    print_detection_reports(reports)
 
     # 5. Lưu kết quả
     output_file = os.path.join('output', f'suspect_transactions_{student_id}.csv')
@@ -165,6 +320,7 @@ def detect_anomalies(student_id=None):
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         student_id = sys.argv[1]
-        detect_anomalies(student_id)
+        by = sys.argv[2] if len(sys.argv) > 2 else None
+        detect_anomalies(student_id, by=by)
     else:
-        print("Usage: python detect_anomalies.py <student_id>")
+        print("Usage: python detect_anomalies.py <student_id> [customer|customer_month]")
@@ -4,6 +4,7 @@ import random
 import sys
 import os
 from colorama import init, Fore, Style
+import column_stats
 
 init()  # Khởi tạo colorama
 
@@ -126,6 +127,9 @@ def generate_data(student_id):
 
     df = save_to_csv(data, student_id)
 
+    # Lưu thống kê cột từ dữ liệu trong bộ nhớ để các bước sau không phải quét lại
+    column_stats.write_stats(student_id, df)
+
     print("\n" + "=" * 50)
     print(f"{Fore.GREEN}Hoàn thành tạo dữ liệu!{Style.RESET_ALL}")
 
@@ -0,0 +1,146 @@
+import os
+import numpy as np
+
+# Numba là tùy chọn: nếu không có, mọi hàm dùng NumPy và cho kết quả giống hệt
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Backend: 'auto' (Numba nếu có), 'numba' hoặc 'numpy'; đổi qua biến môi trường KERNEL_BACKEND
+BACKEND = 'auto'
+
+def set_backend(name):
+    """Chọn backend cho các hàm tính toán: 'auto', 'numba' hoặc 'numpy'"""
+    global BACKEND
+    if name not in ('auto', 'numba', 'numpy'):
+        raise ValueError(f"Backend không hợp lệ: {name}")
+    if name == 'numba' and numba is None:
+        raise ImportError("Chưa cài đặt numba")
+    BACKEND = name
+
+# Giá trị sai trong KERNEL_BACKEND báo lỗi ngay, giống --backend
+set_backend(os.environ.get('KERNEL_BACKEND') or 'auto')
+
+def active_backend():
+    """Backend thực sự được dùng"""
+    if BACKEND == 'numpy' or numba is None:
+        return 'numpy'
+    return 'numba'
+
+# --- Cài đặt NumPy ---------------------------------------------------------
+
+def _total_amount_numpy(quantity, price, discount):
+    # np.round(x, 2) = rint(x * 100) / 100, giống round() của pandas
+    return np.round(quantity * price * (1 - discount), 2)
+
+def _invalid_rows_numpy(price, quantity, discount, total):
+    return (np.isnan(price) | np.isnan(quantity) | np.isnan(discount) | np.isnan(total) |
+            (price < 0) | (quantity < 0) |
+            (discount < 0) | (discount > 1) |
+            (np.abs(total - _total_amount_numpy(quantity, price, discount)) > 0.01))
+
+def _declining_starts_numpy(codes, counts):
+    same = (codes[:-2] == codes[1:-1]) & (codes[1:-1] == codes[2:])
+    falling = (counts[:-2] > counts[1:-1]) & (counts[1:-1] > counts[2:])
+    return np.flatnonzero(same & falling)
+
+def _flag_outside_numpy(values, lower, upper):
+    return (values < lower) | (values > upper)
+
+def _flag_zscore_numpy(values, mean, std, threshold):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.abs((values - mean) / std) > threshold
+
+# --- Cài đặt Numba (biên dịch khi gọi lần đầu, một vòng lặp, không tạo mảng trung gian)
+
+if numba is not None:
+    _jit = numba.njit(cache=True, error_model='numpy')
+
+    @_jit
+    def _total_amount_numba(quantity, price, discount):
+        out = np.empty(quantity.shape[0])
+        for i in range(quantity.shape[0]):
+            out[i] = np.rint(quantity[i] * price[i] * (1 - discount[i]) * 100.0) / 100.0
+        return out
+
+    @_jit
+    def _invalid_rows_numba(price, quantity, discount, total):
+        out = np.empty(price.shape[0], dtype=np.bool_)
+        for i in range(price.shape[0]):
+            p, q, d, t = price[i], quantity[i], discount[i], total[i]
+            expected = np.rint(q * p * (1 - d) * 100.0) / 100.0
+            out[i] = (np.isnan(p) or np.isnan(q) or np.isnan(d) or np.isnan(t) or
+                      p < 0 or q < 0 or d < 0 or d > 1 or
+                      abs(t - expected) > 0.01)
+        return out
+
+    @_jit
+    def _declining_starts_numba(codes, counts):
+        n = codes.shape[0]
+        mask = np.zeros(max(n - 2, 0), dtype=np.bool_)
+        for i in range(n - 2):
+            mask[i] = (codes[i] == codes[i + 1] and codes[i + 1] == codes[i + 2] and
+                       counts[i] > counts[i + 1] and counts[i + 1] > counts[i + 2])
+        return np.flatnonzero(mask)
+
+    @_jit
+    def _flag_outside_numba(values, lower, upper):
+        out = np.empty(values.shape[0], dtype=np.bool_)
+        for i in range(values.shape[0]):
+            out[i] = values[i] < lower[i] or values[i] > upper[i]
+        return out
+
+    @_jit
+    def _flag_zscore_numba(values, mean, std, threshold):
+        out = np.empty(values.shape[0], dtype=np.bool_)
+        for i in range(values.shape[0]):
+            out[i] = abs((values[i] - mean[i]) / std[i]) > threshold
+        return out
+
+# --- Hàm dùng chung --------------------------------------------------------
+
+def _floats(values):
+    return np.ascontiguousarray(values, dtype=np.float64)
+
+def _per_row(value, n):
+    """Ngưỡng vô hướng hoặc theo từng dòng → mảng độ dài n"""
+    return np.broadcast_to(np.asarray(value, dtype=np.float64), (n,))
+
+def total_amount(quantity, price, discount):
+    """round(quantity * price * (1 - discount), 2)"""
+    quantity, price, discount = _floats(quantity), _floats(price), _floats(discount)
+    if active_backend() == 'numba':
+        return _total_amount_numba(quantity, price, discount)
+    return _total_amount_numpy(quantity, price, discount)
+
+def invalid_rows(price, quantity, discount, total):
+    """Mặt nạ các dòng lỗi: thiếu giá trị, giá trị âm, discount ngoài [0, 1], total sai"""
+    args = [_floats(a) for a in (price, quantity, discount, total)]
+    if active_backend() == 'numba':
+        return _invalid_rows_numba(*args)
+    return _invalid_rows_numpy(*args)
+
+def declining_starts(codes, counts):
+    """Vị trí bắt đầu các chuỗi 3 dòng liên tiếp cùng nhóm có giá trị giảm dần"""
+    codes = np.ascontiguousarray(codes, dtype=np.int64)
+    counts = np.ascontiguousarray(counts, dtype=np.int64)
+    if active_backend() == 'numba':
+        return _declining_starts_numba(codes, counts)
+    return _declining_starts_numpy(codes, counts)
+
+def flag_outside(values, lower=-np.inf, upper=np.inf):
+    """Mặt nạ giá trị nằm ngoài [lower, upper] (ngưỡng vô hướng hoặc theo từng dòng)"""
+    values = _floats(values)
+    if active_backend() == 'numba':
+        n = len(values)
+        return _flag_outside_numba(values, _per_row(lower, n), _per_row(upper, n))
+    return _flag_outside_numpy(values, lower, upper)
+
+def flag_zscore(values, mean, std, threshold):
+    """Mặt nạ |(values - mean) / std| > threshold (mean, std vô hướng hoặc theo từng dòng)"""
+    values = _floats(values)
+    if active_backend() == 'numba':
+        n = len(values)
+        return _flag_zscore_numba(values, _per_row(mean, n), _per_row(std, n), float(threshold))
+    return _flag_zscore_numpy(values, mean, std, threshold)
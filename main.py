@@ -26,7 +26,8 @@ def install_requirements():
         'scikit-learn',
         'matplotlib',
         'seaborn',
-        'colorama'
+        'colorama',
+        'pyarrow'
     ]
 
     print(f"\n{Fore.BLUE}Kiểm tra thư viện...{Style.RESET_ALL}")
@@ -73,6 +74,10 @@ def main():
     from analyze_data import analyze_data
     from detect_anomalies import detect_anomalies
     from advanced_analysis import analyze_advanced
+    import session_cache
+
+    # Giữ dữ liệu đã đọc giữa các lựa chọn trên cùng bộ dữ liệu
+    session_cache.enable()
 
     while True:
         clear_screen()
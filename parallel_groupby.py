@@ -0,0 +1,192 @@
+import os
+import sys
+import time
+import atexit
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+# Số dòng tối thiểu để chia cho nhiều tiến trình; ít hơn thì tính ngay trong tiến trình hiện tại
+PARALLEL_MIN_ROWS = int(os.environ.get('PARALLEL_GROUPBY_ROWS', 1_000_000))
+
+# Số tiến trình mặc định (mặc định bằng số lõi CPU)
+PARALLEL_WORKERS = int(os.environ.get('PARALLEL_GROUPBY_WORKERS', os.cpu_count() or 1))
+
+# Các hàm tổng hợp được hỗ trợ
+AGGREGATIONS = ('size', 'sum', 'mean', 'min', 'max', 'nunique')
+
+# Nhóm tiến trình dùng chung cho mọi lần gọi (tạo khi cần lần đầu)
+_executor = None
+_executor_workers = 0
+
+def _get_executor(workers):
+    """Nhóm tiến trình dùng lại giữa các lần gọi, chỉ tạo lại khi cần thêm tiến trình"""
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers < workers:
+        if _executor is not None:
+            _executor.shutdown()
+        _executor = ProcessPoolExecutor(max_workers=workers)
+        _executor_workers = workers
+    return _executor
+
+@atexit.register
+def _shutdown_executor():
+    if _executor is not None:
+        _executor.shutdown()
+
+def _aggregate_frame(frame, key_columns, plan):
+    """Tổng hợp một DataFrame bằng groupby của pandas (dùng cho cả từng phân vùng)"""
+    grouped = frame.groupby(key_columns, sort=False)
+    named = {name: (column, func) for name, (column, func) in plan.items() if func != 'size'}
+    result = grouped.agg(**named) if named else pd.DataFrame(index=grouped.size().index)
+    for name, (_, func) in plan.items():
+        if func == 'size':
+            result[name] = grouped.size()
+    return result[list(plan)]
+
+def _aggregate_partition(spec, start, stop, key_columns, plan):
+    """Hàm chạy trong tiến trình con: chỉ tổng hợp các dòng [start, stop) của phân vùng mình"""
+    blocks = {name: shared_memory.SharedMemory(name=shm_name) for name, (shm_name, _, _) in spec.items()}
+    try:
+        frame = pd.DataFrame({
+            name: np.ndarray((length,), dtype=dtype, buffer=blocks[name].buf)[start:stop].copy()
+            for name, (_, dtype, length) in spec.items()
+        })
+        return _aggregate_frame(frame, key_columns, plan).reset_index()
+    finally:
+        for shm in blocks.values():
+            shm.close()
+
+def _partition_ids(key_codes, parts):
+    """Phân vùng của từng dòng theo mã băm của khóa (mọi dòng của một nhóm cùng phân vùng)"""
+    hashed = np.zeros(len(key_codes[0]), dtype=np.uint64)
+    for codes in key_codes:
+        hashed = hashed * np.uint64(1_000_003) ^ pd.util.hash_array(codes)
+    return (hashed % np.uint64(parts)).astype(np.intp)
+
+def _parallel_aggregate(columns, key_columns, plan, workers):
+    """Chia các dòng theo phân vùng băm cho nhiều tiến trình rồi ghép kết quả"""
+    parts = _partition_ids([columns[c] for c in key_columns], workers)
+    order = np.argsort(parts, kind='stable')
+    bounds = np.searchsorted(parts[order], np.arange(workers + 1))
+
+    blocks = []
+    try:
+        # Sắp các dòng theo phân vùng ngay khi chép vào bộ nhớ dùng chung
+        spec = {}
+        for name, array in columns.items():
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(shm)
+            np.take(array, order, out=np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf))
+            spec[name] = (shm.name, array.dtype.str, len(array))
+
+        executor = _get_executor(workers)
+        futures = [executor.submit(_aggregate_partition, spec, int(bounds[p]), int(bounds[p + 1]),
+                                   key_columns, plan)
+                   for p in range(workers) if bounds[p + 1] > bounds[p]]
+        partials = [future.result() for future in futures]
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    return pd.concat(partials, ignore_index=True)
+
+def group_aggregate(keys, aggs, workers=None, min_rows=None):
+    """Tổng hợp theo nhóm, chia các dòng cho nhiều tiến trình khi dữ liệu lớn
+
+    keys: danh sách cột khóa (Series, không có giá trị thiếu).
+    aggs: dict tên cột kết quả -> (giá trị, hàm) với giá trị là mảng/Series cùng
+    độ dài (None cho 'size') và hàm thuộc AGGREGATIONS.
+    Kết quả là DataFrame có index theo khóa, sắp xếp như groupby.
+
+    Tiến trình chính chỉ đánh mã khóa (không sắp xếp) và chia các dòng theo mã
+    băm của khóa; mỗi tiến trình con tổng hợp riêng các dòng của phân vùng mình
+    nên các nhóm không bị tách. Dữ liệu nhỏ, chỉ một tiến trình, hoặc khi đang
+    chạy trong tiến trình con (batch/service đã song song theo bộ dữ liệu) thì
+    dùng groupby của pandas ngay trong tiến trình hiện tại.
+    """
+    workers = PARALLEL_WORKERS if workers is None else workers
+    min_rows = PARALLEL_MIN_ROWS if min_rows is None else min_rows
+
+    columns, key_columns, uniques, plan = {}, [], [], {}
+    for i, key in enumerate(keys):
+        codes, levels = pd.factorize(key)
+        columns[f'key_{i}'] = codes.astype(np.int64)
+        key_columns.append(f'key_{i}')
+        uniques.append(levels)
+    for name, (values, func) in aggs.items():
+        if func not in AGGREGATIONS:
+            raise ValueError(f"Hàm tổng hợp không hợp lệ: {func}")
+        if values is None:
+            plan[name] = (None, func)
+            continue
+        values = np.asarray(values)
+        if values.dtype.kind not in 'iufb':
+            values = pd.factorize(values)[0]  # Chỉ còn dùng được cho nunique
+        column = f'value_{len(plan)}'
+        columns[column] = values
+        plan[name] = (column, func)
+
+    rows = len(columns[key_columns[0]])
+    if workers <= 1 or rows < min_rows or multiprocessing.parent_process() is not None:
+        result = _aggregate_frame(pd.DataFrame(columns), key_columns, plan).reset_index()
+    else:
+        result = _parallel_aggregate(columns, key_columns, plan, workers)
+
+    # Đổi mã khóa về giá trị gốc và sắp xếp theo khóa như groupby
+    names = [getattr(key, 'name', None) for key in keys]
+    arrays = [levels.take(result[c].to_numpy()) for c, levels in zip(key_columns, uniques)]
+    if len(keys) == 1:
+        index = pd.Index(arrays[0], name=names[0])
+    else:
+        index = pd.MultiIndex.from_arrays(arrays, names=names)
+    return result[list(plan)].set_axis(index).sort_index()
+
+def benchmark(rows, customers, workers, repeat=3):
+    """So sánh thời gian với groupby của pandas trên bảng tổng hợp khách hàng × giờ"""
+    rng = np.random.default_rng(42)
+    df = pd.DataFrame({
+        'customer_id': pd.Series(rng.integers(0, customers, rows)).map(lambda c: f'C{c:05d}'),
+        'order_date': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365 * 24 * 3600, rows), unit='s'),
+        'quantity': rng.integers(1, 10, rows),
+        'total_amount': rng.gamma(2, 100, rows)
+    })
+    hour = df['order_date'].dt.floor('h').rename('hour')
+
+    def run_pandas():
+        return (df.assign(hour=hour).groupby(['customer_id', 'hour'])
+                  .agg(order_count=('total_amount', 'size'),
+                       item_count=('quantity', 'sum'),
+                       revenue=('total_amount', 'sum')))
+
+    def run_parallel():
+        return group_aggregate([df['customer_id'], hour], {
+            'order_count': (None, 'size'),
+            'item_count': (df['quantity'], 'sum'),
+            'revenue': (df['total_amount'], 'sum')
+        }, workers=workers, min_rows=0)
+
+    expected = run_pandas()
+    pd.testing.assert_frame_equal(run_parallel(), expected, check_dtype=False, check_index_type=False)
+
+    for name, func in [('pandas', run_pandas), (f'parallel ({workers} tiến trình)', run_parallel)]:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        print(f"→ {name}: {min(timings):.3f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="So sánh group_aggregate với groupby của pandas")
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--customers', type=int, default=1_000)
+    parser.add_argument('--workers', type=int, default=PARALLEL_WORKERS)
+    args = parser.parse_args()
+    if args.workers < 2:
+        print("Cần ít nhất 2 tiến trình (--workers) để so sánh")
+        sys.exit(1)
+    benchmark(args.rows, args.customers, args.workers)
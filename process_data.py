@@ -1,34 +1,14 @@
 import sys
 import os
-import pandas as pd
 import numpy as np
 from colorama import init, Fore, Style
+from datasets import list_available_files, read_transactions
+import session_cache
+import kernels
+import column_stats
 
 init()
 
-def list_available_files():
-    """Liệt kê các file dữ liệu có sẵn"""
-    files = [f for f in os.listdir('output') if f.startswith('transactions_')]
-    if not files:
-        print(f"\n{Fore.RED}Không tìm thấy file dữ liệu nào trong thư mục output!{Style.RESET_ALL}")
-        return None
-
-    print(f"\n{Fore.YELLOW}Danh sách file dữ liệu:{Style.RESET_ALL}")
-    for i, file in enumerate(files, 1):
-        file_path = os.path.join('output', file)
-        file_size = os.path.getsize(file_path) / (1024 * 1024)  # Convert to MB
-        print(f"{i}. {file} ({file_size:.1f} MB)")
-
-    while True:
-        try:
-            choice = input(f"\n{Fore.YELLOW}Chọn file để phân tích (1-{len(files)}): {Style.RESET_ALL}")
-            idx = int(choice) - 1
-            if 0 <= idx < len(files):
-                return files[idx].replace('transactions_', '').replace('.csv', '')
-        except ValueError:
-            pass
-        print(f"{Fore.RED}Lựa chọn không hợp lệ!{Style.RESET_ALL}")
-
 def load_data(student_id):
     """Đọc và chuẩn bị dữ liệu"""
     print(f"{Fore.BLUE}[1/5] Đọc dữ liệu từ file CSV{Style.RESET_ALL}")
@@ -36,14 +16,7 @@ def load_data(student_id):
     input_file = os.path.join('output', f'transactions_{student_id}.csv')
     print(f"File: {input_file}")
 
-    df = pd.read_csv(input_file,
-                    dtype={
-                        'customer_id': str,
-                        'price': float,
-                        'quantity': int,
-                        'discount': float
-                    },
-                    parse_dates=['order_date'])
+    df = session_cache.cached_frame(student_id, 'raw', lambda: read_transactions(input_file))
 
     print(f"→ Đọc thành công {len(df):,} dòng")
 
@@ -51,43 +24,40 @@ def load_data(student_id):
     print(df.dtypes)
     return df
 
-def calculate_total(df):
-    """Tính toán total_amount"""
+def calculate_total(df, student_id=None):
+    """Tính toán total_amount
+
+    Khi có student_id, thống kê được lấy từ file thống kê đi kèm (tạo từ df
+    nếu chưa có) thay vì quét lại cột.
+    """
     print(f"\n{Fore.BLUE}[2/5] Tính toán total_amount{Style.RESET_ALL}")
 
     # Tạo cột total_amount nếu chưa có
-    if 'total_amount' not in df.columns:
-        df['total_amount'] = round(df['quantity'] * df['price'] * (1 - df['discount']), 2)
+    stored = 'total_amount' in df.columns
+    if not stored:
+        df['total_amount'] = kernels.total_amount(df['quantity'], df['price'], df['discount'])
 
     print("→ Đã tạo cột total_amount")
 
+    # File thống kê luôn tính total_amount từ các cột gốc, nên chỉ dùng khi file không có sẵn cột này
+    stats = column_stats.load_stats(student_id, lambda: df) if student_id is not None else None
+    if stats is not None and not stored:
+        summary = stats['columns']['total_amount']
+    else:
+        summary = column_stats.column_summary(df['total_amount'])
+
     print("\nThống kê cột total_amount:")
-    print(f"Giá trị thấp nhất: ${df['total_amount'].min():.2f}")
-    print(f"Giá trị cao nhất: ${df['total_amount'].max():.2f}")
-    print(f"Giá trị trung bình: ${df['total_amount'].mean():.2f}")
+    print(f"Giá trị thấp nhất: ${summary['min']:.2f}")
+    print(f"Giá trị cao nhất: ${summary['max']:.2f}")
+    print(f"Giá trị trung bình: ${summary['mean']:.2f}")
     return df
 
 def separate_data(df):
     """Tách dữ liệu thành good và bad"""
     print(f"\n{Fore.BLUE}[3/5] Phân tách dữ liệu tốt và xấu{Style.RESET_ALL}")
 
-    # Lọc ra các dòng có lỗi (null hoặc giá trị không hợp lệ)
-    error_conditions = (
-        # Kiểm tra null
-        df['price'].isna() |
-        df['quantity'].isna() |
-        df['discount'].isna() |
-        df['total_amount'].isna() |
-        # Kiểm tra giá trị âm
-        (df['price'] < 0) |
-        (df['quantity'] < 0) |
-        # Kiểm tra discount hợp lệ
-        (df['discount'] < 0) |
-        (df['discount'] > 1) |
-        # Kiểm tra total_amount
-        (abs(df['total_amount'] -
-             round(df['quantity'] * df['price'] * (1 - df['discount']), 2)) > 0.01)
-    )
+    # Lọc ra các dòng có lỗi (null, giá trị âm, discount ngoài [0, 1], total_amount sai)
+    error_conditions = kernels.invalid_rows(df['price'], df['quantity'], df['discount'], df['total_amount'])
 
     bad_rows = df[error_conditions]
     good_rows = df[~error_conditions]
@@ -131,7 +101,7 @@ def process_data(student_id=None):
     df = load_data(student_id)
 
     # 2. Tính total_amount
-    df = calculate_total(df)
+    df = calculate_total(df, student_id)
 
     # 3. Tách dữ liệu
     good_rows, bad_rows = separate_data(df)
@@ -0,0 +1,145 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from calendar_keys import calendar_keys, day_to_datetime, week_key
+from datasets import dataset_path
+from parallel_groupby import group_aggregate
+
+# Các cột đo lường trong bảng tổng hợp theo giờ
+MEASURES = ['order_count', 'item_count', 'revenue', 'discount_sum']
+
+# Các cột khóa lịch được lưu cùng bảng tổng hợp theo giờ
+CALENDAR_KEYS = ['day', 'month', 'iso_year', 'iso_week']
+
+# Chỉ lưu bảng tổng hợp khi nó nhỏ hơn dữ liệu gốc ít nhất bấy nhiêu lần
+MIN_SHRINK = 2
+
+def rollup_path(student_id, level='hourly'):
+    """Đường dẫn file tổng hợp (pickle, giữ nguyên kiểu dữ liệu) của một bộ dữ liệu"""
+    return os.path.join('output', f'rollup_{level}_{student_id}.pkl')
+
+def _is_fresh(output_file, input_file):
+    return (os.path.exists(output_file) and
+            os.path.getmtime(output_file) >= os.path.getmtime(input_file))
+
+def has_fresh_rollup(student_id, level='hourly'):
+    """Có bảng tổng hợp đã lưu và không cũ hơn file giao dịch không"""
+    return _is_fresh(rollup_path(student_id, level), dataset_path(student_id))
+
+def build_hourly_rollup(df):
+    """Gộp giao dịch thành bảng tổng hợp theo giờ cho từng khách hàng"""
+    hour = df['order_date'].dt.floor('h').rename('hour')
+    hourly = group_aggregate([df['customer_id'], hour], {
+        'order_count': (None, 'size'),
+        'item_count': (df['quantity'], 'sum'),
+        'revenue': (df['total_amount'], 'sum'),
+        'discount_sum': (df['discount'], 'sum')
+    }).reset_index()
+    return add_calendar_keys(hourly)
+
+def add_calendar_keys(hourly):
+    """Thêm các cột khóa lịch (day, month, iso_year, iso_week) tính một lần cho bảng theo giờ
+
+    Các bảng theo ngày, tuần, tháng dùng lại các cột này thay vì tính lại từ cột hour.
+    """
+    if all(key in hourly.columns for key in CALENDAR_KEYS):
+        return hourly
+    keys = calendar_keys(hourly['hour'])
+    return hourly.assign(**{key: keys[key] for key in CALENDAR_KEYS})
+
+def load_hourly_rollup(student_id, load_df):
+    """Đọc bảng tổng hợp theo giờ, tạo lại nếu chưa có hoặc cũ hơn file giao dịch
+
+    load_df chỉ được gọi khi cần tạo lại bảng tổng hợp từ dữ liệu gốc. Bảng chỉ
+    được lưu khi nhỏ hơn dữ liệu gốc ít nhất MIN_SHRINK lần, nếu không việc ghi
+    file chỉ tốn thêm thời gian và dung lượng.
+    """
+    input_file = dataset_path(student_id)
+    output_file = rollup_path(student_id)
+
+    if _is_fresh(output_file, input_file):
+        hourly = add_calendar_keys(pd.read_pickle(output_file))
+        print(f"→ Dùng bảng tổng hợp theo giờ: {output_file} ({len(hourly):,} dòng)")
+        return hourly
+
+    df = load_df()
+    hourly = build_hourly_rollup(df)
+    print(f"→ Đã tạo bảng tổng hợp theo giờ: {len(df):,} → {len(hourly):,} dòng")
+    if len(hourly) * MIN_SHRINK <= len(df):
+        hourly.to_pickle(output_file)
+        print(f"→ Đã lưu vào file: {output_file}")
+    else:
+        print(f"→ Không lưu bảng tổng hợp (không nhỏ hơn dữ liệu gốc {MIN_SHRINK} lần)")
+    return hourly
+
+def aggregate_rollup(hourly, keys):
+    """Cộng dồn các cột đo lường của bảng tổng hợp theo các khóa cho trước"""
+    return hourly.groupby(keys)[MEASURES].sum()
+
+def daily_rollup(hourly):
+    """Tổng hợp theo ngày (toàn bộ khách hàng)"""
+    hourly = add_calendar_keys(hourly)
+    daily = aggregate_rollup(hourly, 'day')
+    daily.index = pd.DatetimeIndex(day_to_datetime(daily.index), name='date')
+    return daily
+
+def weekly_rollup(hourly):
+    """Tổng hợp theo tuần ISO cho từng khách hàng"""
+    weekly = add_calendar_keys(hourly).rename(columns={'iso_year': 'year', 'iso_week': 'week'})
+    return aggregate_rollup(weekly, ['customer_id', 'year', 'week']).reset_index()
+
+def weekly_matrix(hourly, measure='revenue'):
+    """Ma trận thưa khách hàng × tuần ISO (CSR, float32) của một cột đo lường
+
+    Trả về (matrix, customers, weeks): dòng i ứng với customers[i], cột j ứng
+    với khóa tuần weeks[j] (YYYYWW). Ô chỉ được lưu khi khách hàng có giao dịch
+    trong tuần, nên chi tiêu 0 thực sự vẫn phân biệt được với "không mua".
+    """
+    hourly = add_calendar_keys(hourly)
+    rows, customers = pd.factorize(hourly['customer_id'], sort=True)
+    cols, weeks = pd.factorize(week_key(hourly['iso_year'], hourly['iso_week']), sort=True)
+
+    # Cộng các giờ trùng ô bằng float64 rồi mới đổi sang float32
+    matrix = sparse.csr_matrix(
+        (hourly[measure].to_numpy(np.float64), (rows, cols)),
+        shape=(len(customers), len(weeks)))
+    matrix.sum_duplicates()
+    return matrix.astype(np.float32), np.asarray(customers), np.asarray(weeks)
+
+def monthly_rollup(hourly):
+    """Tổng hợp theo tháng cho từng khách hàng (year_month là khóa tháng số nguyên)"""
+    monthly = add_calendar_keys(hourly).rename(columns={'month': 'year_month'})
+    return aggregate_rollup(monthly, ['customer_id', 'year_month']).reset_index()
+
+def save_monthly_rollup(student_id, monthly):
+    """Lưu bảng tổng hợp theo tháng cho từng khách hàng
+
+    Bảng này luôn được lưu (không theo quy tắc MIN_SHRINK): nó chỉ có một dòng
+    cho mỗi khách hàng và tháng, và là nguồn số dòng của từng tầng khi lấy mẫu
+    gần đúng, kể cả khi bảng theo giờ không được lưu.
+    """
+    output_file = rollup_path(student_id, 'monthly')
+    monthly.to_pickle(output_file)
+    print(f"→ Đã lưu bảng tổng hợp theo tháng: {output_file} ({len(monthly):,} dòng)")
+
+def load_monthly_rollup(student_id, load_df=None):
+    """Đọc bảng tổng hợp theo tháng cho từng khách hàng, tạo từ bảng theo giờ nếu chưa có
+
+    Bảng theo tháng được lưu riêng để các bước chỉ cần số liệu theo tháng không
+    phải đọc bảng theo giờ hay dữ liệu gốc. Khi không truyền load_df và chưa có
+    bảng theo giờ đã lưu, trả về None thay vì đọc toàn bộ dữ liệu gốc.
+    """
+    input_file = dataset_path(student_id)
+    output_file = rollup_path(student_id, 'monthly')
+
+    if _is_fresh(output_file, input_file):
+        monthly = pd.read_pickle(output_file)
+        print(f"→ Dùng bảng tổng hợp theo tháng: {output_file} ({len(monthly):,} dòng)")
+        return monthly
+    if load_df is None and not _is_fresh(rollup_path(student_id), input_file):
+        return None
+
+    monthly = monthly_rollup(load_hourly_rollup(student_id, load_df))
+    save_monthly_rollup(student_id, monthly)
+    return monthly
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+def segment_codes(keys):
+    """Mã nhóm số nguyên 0..n-1 cho một hoặc nhiều cột khóa, trả về (codes, n)"""
+    codes, uniques = pd.factorize(keys[0])
+    n = len(uniques)
+    for key in keys[1:]:
+        key_codes, key_uniques = pd.factorize(key)
+        codes, uniques = pd.factorize(codes.astype(np.int64) * len(key_uniques) + key_codes)
+        n = len(uniques)
+    return codes, n
+
+def segment_moments(values, codes, n):
+    """Số dòng, trung bình và độ lệch chuẩn (ddof=0) của từng nhóm"""
+    values = np.asarray(values, dtype=np.float64)
+    counts = np.bincount(codes, minlength=n)
+    mean = np.bincount(codes, values, minlength=n) / counts
+    var = np.bincount(codes, (values - mean[codes]) ** 2, minlength=n) / counts
+    return counts, mean, np.sqrt(var)
+
+def segment_quantiles(values, codes, n, qs):
+    """Phân vị (nội suy tuyến tính như pandas) của từng nhóm, dùng một lần sắp xếp
+
+    Trả về mảng kích thước (n, len(qs)).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    order = np.lexsort((values, codes))
+    sorted_values = values[order]
+    counts = np.bincount(codes, minlength=n)
+    starts = np.cumsum(counts) - counts
+
+    result = np.empty((n, len(qs)))
+    for j, q in enumerate(qs):
+        position = q * (counts - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, counts - 1)
+        low_values = sorted_values[starts + lower]
+        high_values = sorted_values[starts + upper]
+        result[:, j] = low_values + (position - lower) * (high_values - low_values)
+    return result
@@ -0,0 +1,379 @@
+import os
+import re
+import json
+import uuid
+import asyncio
+import argparse
+import contextlib
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from colorama import init, Fore, Style
+from datasets import find_datasets, dataset_path
+from batch import STAGES, run_stage
+
+init()
+
+# Dòng tiến trình dạng "[n/m] ..." mà các module in ra
+STEP_PATTERN = re.compile(r'\[(\d+)/(\d+)\]\s*(.*)')
+ANSI_PATTERN = re.compile(r'\x1b\[[0-9;]*m')
+
+# Số dòng tối đa của mỗi DataFrame được giữ lại trong kết quả
+RESULT_ROWS = 1000
+
+# Số kết quả tối đa được giữ trong bộ nhớ đệm
+CACHE_SIZE = 64
+
+class ProgressWriter:
+    """Thay cho stdout trong tiến trình con, gửi các dòng [n/m] về tiến trình chính"""
+
+    def __init__(self, job_id, queue):
+        self.job_id = job_id
+        self.queue = queue
+        self.buffer = ''
+
+    def write(self, text):
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split('\n')
+        for line in lines:
+            match = STEP_PATTERN.search(ANSI_PATTERN.sub('', line))
+            if match:
+                step, total, label = match.groups()
+                self.queue.put((self.job_id, {'step': int(step), 'total': int(total), 'label': label}))
+        return len(text)
+
+    def flush(self):
+        pass
+
+def to_jsonable(value, limit=RESULT_ROWS):
+    """Chuyển kết quả của các module sang dạng JSON (DataFrame chỉ giữ limit dòng đầu)"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        frame = value.to_frame() if isinstance(value, pd.Series) else value
+        # Giữ lại index có tên (date, customer_id...), bỏ index số thứ tự
+        frame = frame.reset_index(drop=not any(frame.index.names))
+        return {
+            'rows': len(frame),
+            'columns': [str(c) for c in frame.columns],
+            'data': json.loads(frame.head(limit).to_json(orient='records', date_format='iso'))
+        }
+    if sparse.issparse(value):
+        return sparse_to_jsonable(value, limit=limit)
+    if isinstance(value, tuple) and len(value) == 3 and sparse.issparse(value[0]):
+        # Chi tiêu theo tuần dạng ma trận: (matrix, customers, weeks)
+        return sparse_to_jsonable(*value, limit=limit)
+    if isinstance(value, dict):
+        return {str(k): to_jsonable(v, limit) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(v, limit) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+def sparse_to_jsonable(matrix, customers=None, weeks=None, limit=RESULT_ROWS):
+    """Ma trận thưa dạng CSR (indptr, indices, values) chỉ giữ limit dòng đầu, kèm nhãn dòng/cột"""
+    matrix = matrix.tocsr()
+    head = matrix[:limit]
+    result = {
+        'format': 'csr',
+        'rows': matrix.shape[0],
+        'shape': list(matrix.shape),
+        'indptr': head.indptr.tolist(),
+        'indices': head.indices.tolist(),
+        'values': head.data.tolist()
+    }
+    if customers is not None:
+        result['customers'] = to_jsonable(np.asarray(customers)[:limit])
+    if weeks is not None:
+        result['weeks'] = to_jsonable(np.asarray(weeks))
+    return result
+
+def _init_worker():
+    """Khởi tạo tiến trình con: vẽ biểu đồ không cần màn hình"""
+    os.environ['MPLBACKEND'] = 'Agg'
+
+def _run_job(job_id, stage, dataset, params, queue):
+    """Chạy một bước trong tiến trình con, trả về kết quả dạng JSON"""
+    writer = ProgressWriter(job_id, queue)
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(writer), contextlib.redirect_stderr(devnull):
+        result = run_stage(stage, dataset, **params)
+    return to_jsonable(result)
+
+class Job:
+    """Trạng thái của một yêu cầu phân tích"""
+
+    def __init__(self, stage, dataset, params, mtime):
+        self.id = uuid.uuid4().hex[:12]
+        self.stage = stage
+        self.dataset = dataset
+        self.params = params
+        self.mtime = mtime
+        self.status = 'queued'
+        self.progress = []
+        self.result = None
+        self.error = None
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        """Đánh thức các kết nối đang chờ tiến trình của job"""
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'stage': self.stage,
+            'dataset': self.dataset,
+            'params': self.params,
+            'status': self.status,
+            'progress': self.progress,
+            'error': self.error
+        }
+
+class JobService:
+    """Nhận job qua HTTP, chạy trong pool tiến trình giới hạn và lưu đệm kết quả"""
+
+    def __init__(self, workers=2):
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        self.manager = multiprocessing.Manager()
+        self.queue = self.manager.Queue()
+        self.jobs = {}
+        self.cache = OrderedDict()
+
+    async def pump_progress(self):
+        """Chuyển tiến trình từ các tiến trình con tới job tương ứng"""
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, self.queue.get)
+            if item is None:
+                break
+            job_id, step = item
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job.progress.append(step)
+                job.notify()
+
+    def submit(self, stage, dataset, params):
+        """Tạo job mới hoặc trả lại job giống hệt đang chạy/đã có kết quả"""
+        mtime = os.path.getmtime(dataset_path(dataset))
+        key = (stage, dataset, json.dumps(params, sort_keys=True))
+
+        job = self.cache.get(key)
+        if job is not None and job.mtime == mtime and job.status != 'error':
+            self.cache.move_to_end(key)
+            return job, True
+
+        job = Job(stage, dataset, params, mtime)
+        self.jobs[job.id] = job
+        self.cache[key] = job
+        self.cache.move_to_end(key)
+        self.evict()
+
+        asyncio.get_running_loop().create_task(self.run(job))
+        return job, False
+
+    def evict(self):
+        """Bỏ các job đã kết thúc ít dùng nhất khi số job giữ lại vượt CACHE_SIZE
+
+        Job bị thay trong bộ đệm (file đã đổi, job lỗi) được bỏ trước. Job đang
+        chờ hoặc đang chạy không bao giờ bị bỏ (client vẫn theo dõi qua job_id);
+        số job có thể tạm vượt giới hạn cho đến khi chúng xong.
+        """
+        cached = {job.id: key for key, job in self.cache.items()}
+        replaced = [job for job in self.jobs.values() if job.id not in cached]
+        candidates = [job for job in replaced + list(self.cache.values())
+                      if job.status in ('done', 'error')]
+        for job in candidates[:max(len(self.jobs) - CACHE_SIZE, 0)]:
+            del self.jobs[job.id]
+            if job.id in cached:
+                del self.cache[cached[job.id]]
+
+    async def run(self, job):
+        loop = asyncio.get_running_loop()
+        job.status = 'running'
+        job.notify()
+        try:
+            job.result = await loop.run_in_executor(
+                self.executor, _run_job, job.id, job.stage, job.dataset, job.params, self.queue)
+            job.status = 'done'
+        except Exception as e:
+            job.status = 'error'
+            job.error = str(e)
+        job.notify()
+        self.evict()
+
+    async def handle(self, reader, writer):
+        """Xử lý một kết nối HTTP"""
+        try:
+            request_line = (await reader.readline()).decode('latin-1').strip()
+            if not request_line:
+                return
+            method, target, _ = request_line.split(' ', 2)
+
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            body = b''
+            if 'content-length' in headers:
+                body = await reader.readexactly(int(headers['content-length']))
+
+            url = urlsplit(target)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            parts = [p for p in url.path.split('/') if p]
+            await self.route(method, parts, query, body, writer)
+        except asyncio.IncompleteReadError as e:
+            # Nội dung ngắn hơn Content-Length (client đã đóng chiều gửi)
+            with contextlib.suppress(ConnectionError):
+                await self.respond(writer, 400, {'error': f'Nội dung yêu cầu không đủ: '
+                                                          f'{len(e.partial)}/{e.expected} byte'})
+        except (ValueError, KeyError, json.JSONDecodeError) as e:
+            with contextlib.suppress(ConnectionError):
+                await self.respond(writer, 400, {'error': str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            with contextlib.suppress(ConnectionError):
+                writer.close()
+                await writer.wait_closed()
+
+    async def route(self, method, parts, query, body, writer):
+        if method == 'GET' and parts == ['datasets']:
+            return await self.respond(writer, 200, {'datasets': find_datasets()})
+
+        if method == 'GET' and parts == ['stages']:
+            return await self.respond(writer, 200, {'stages': list(STAGES)})
+
+        if method == 'POST' and parts == ['jobs']:
+            request = json.loads(body or b'{}')
+            if not isinstance(request, dict):
+                return await self.respond(writer, 400, {'error': 'Nội dung yêu cầu phải là một object JSON'})
+            stage = request['stage']
+            dataset = request['dataset']
+            params = request.get('params', {})
+            if not isinstance(params, dict):
+                return await self.respond(writer, 400, {'error': 'params phải là một object JSON'})
+            if not isinstance(stage, str) or stage not in STAGES:
+                return await self.respond(writer, 400, {'error': f'Bước không hợp lệ: {stage}'})
+            if dataset not in find_datasets():
+                return await self.respond(writer, 404, {'error': f'Không tìm thấy bộ dữ liệu: {dataset}'})
+            try:
+                job, cached = self.submit(stage, dataset, params)
+            except FileNotFoundError:
+                # File bị xóa sau khi find_datasets() vừa thấy nó
+                return await self.respond(writer, 404, {'error': f'Không tìm thấy bộ dữ liệu: {dataset}'})
+            return await self.respond(writer, 200 if cached else 202, {**job.to_dict(), 'cached': cached})
+
+        if method == 'GET' and len(parts) >= 2 and parts[0] == 'jobs':
+            job = self.jobs.get(parts[1])
+            if job is None:
+                return await self.respond(writer, 404, {'error': 'Không tìm thấy job'})
+            if len(parts) == 2:
+                return await self.respond(writer, 200, job.to_dict())
+            if parts[2] == 'events':
+                return await self.stream_events(job, writer)
+            if parts[2] == 'result':
+                if job.status != 'done':
+                    return await self.respond(writer, 409, job.to_dict())
+                limit = int(query.get('limit', RESULT_ROWS))
+                return await self.respond(writer, 200, {**job.to_dict(), 'result': trim_result(job.result, limit)})
+
+        await self.respond(writer, 404, {'error': 'Không tìm thấy đường dẫn'})
+
+    async def respond(self, writer, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        writer.write(f'HTTP/1.1 {status} {status_text(status)}\r\n'
+                     f'Content-Type: application/json; charset=utf-8\r\n'
+                     f'Content-Length: {len(body)}\r\n'
+                     f'Connection: close\r\n\r\n'.encode('latin-1') + body)
+        await writer.drain()
+
+    async def stream_events(self, job, writer):
+        """Gửi tiến trình của job dạng NDJSON cho đến khi job kết thúc"""
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: application/x-ndjson\r\n'
+                     b'Transfer-Encoding: chunked\r\n'
+                     b'Connection: close\r\n\r\n')
+        sent = 0
+        while True:
+            changed = job.changed
+            events = [{'event': 'progress', **step} for step in job.progress[sent:]]
+            sent = len(job.progress)
+            finished = job.status in ('done', 'error')
+            if finished:
+                events.append({'event': job.status, 'error': job.error})
+            for event in events:
+                chunk = (json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8')
+                writer.write(f'{len(chunk):x}\r\n'.encode('latin-1') + chunk + b'\r\n')
+            await writer.drain()
+            if finished:
+                break
+            await changed.wait()
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    def close(self):
+        self.queue.put(None)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.manager.shutdown()
+
+def trim_result(value, limit):
+    """Cắt bớt số dòng của các DataFrame trong kết quả đã lưu"""
+    if isinstance(value, dict) and 'data' in value and 'rows' in value:
+        return {**value, 'data': value['data'][:limit]}
+    if isinstance(value, dict) and value.get('format') == 'csr':
+        end = value['indptr'][min(limit, len(value['indptr']) - 1)]
+        trimmed = {**value, 'indptr': value['indptr'][:limit + 1],
+                   'indices': value['indices'][:end], 'values': value['values'][:end]}
+        if 'customers' in value:
+            trimmed['customers'] = value['customers'][:limit]
+        return trimmed
+    if isinstance(value, dict):
+        return {k: trim_result(v, limit) for k, v in value.items()}
+    if isinstance(value, list):
+        return [trim_result(v, limit) for v in value]
+    return value
+
+def status_text(status):
+    return {200: 'OK', 202: 'Accepted', 400: 'Bad Request',
+            404: 'Not Found', 409: 'Conflict'}.get(status, 'OK')
+
+async def serve(port=8765, workers=2):
+    """Chạy dịch vụ job trên localhost"""
+    service = JobService(workers)
+    server = await asyncio.start_server(service.handle, '127.0.0.1', port)
+    pump = asyncio.create_task(service.pump_progress())
+
+    print(f"{Fore.GREEN}Dịch vụ phân tích đang chạy tại http://127.0.0.1:{port}{Style.RESET_ALL}")
+    print(f"→ Số tiến trình tối đa: {workers}")
+    print(f"→ Các bước: {', '.join(STAGES)}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+        await pump
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dịch vụ HTTP chạy phân tích trên localhost")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=2,
+                        help="Số job chạy đồng thời tối đa")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.port, args.workers))
+    except KeyboardInterrupt:
+        print("\n\nĐã dừng dịch vụ.")
@@ -0,0 +1,74 @@
+import os
+from collections import OrderedDict
+from datasets import dataset_path
+
+# Giới hạn bộ nhớ mặc định (MB), có thể đổi qua biến môi trường
+DEFAULT_LIMIT_MB = int(os.environ.get('SESSION_CACHE_MB', 1024))
+
+_enabled = False
+_limit = DEFAULT_LIMIT_MB * 1024 * 1024
+_frames = OrderedDict()  # (student_id, kind) -> (mtime, df, size)
+
+def enable(limit_mb=None):
+    """Bật bộ nhớ đệm DataFrame cho phiên làm việc (menu chính)"""
+    global _enabled, _limit
+    _enabled = True
+    _limit = (limit_mb if limit_mb is not None else DEFAULT_LIMIT_MB) * 1024 * 1024
+    _evict()
+
+def disable():
+    """Tắt và xóa bộ nhớ đệm"""
+    global _enabled
+    _enabled = False
+    _frames.clear()
+
+def memory_usage():
+    """Tổng bộ nhớ (bytes) của các DataFrame đang được giữ"""
+    return sum(size for _, _, size in _frames.values())
+
+def _evict():
+    while _frames and memory_usage() > _limit:
+        _frames.popitem(last=False)
+
+def contains(student_id, kind):
+    """Có DataFrame đã đọc trong phiên còn khớp với file không (không in thông báo)"""
+    if not _enabled:
+        return False
+    key = (student_id, kind)
+    entry = _frames.get(key)
+    if entry is None:
+        return False
+    if entry[0] != os.path.getmtime(dataset_path(student_id)):
+        del _frames[key]
+        return False
+    return True
+
+def lookup(student_id, kind):
+    """Bản sao nông của DataFrame đã đọc, None nếu chưa có hoặc file đã thay đổi"""
+    if not contains(student_id, kind):
+        return None
+    key = (student_id, kind)
+    entry = _frames[key]
+    _frames.move_to_end(key)
+    print(f"→ Dùng dữ liệu đã đọc trong phiên ({len(entry[1]):,} dòng)")
+    return entry[1].copy(deep=False)
+
+def cached_frame(student_id, kind, loader):
+    """Trả về DataFrame đã đọc trong phiên, hoặc gọi loader() rồi lưu lại
+
+    Kết quả là bản sao nông: các bước thêm cột vào DataFrame không làm thay
+    đổi bản được lưu. Khi vượt giới hạn bộ nhớ, bản ít dùng gần đây nhất bị bỏ.
+    """
+    df = lookup(student_id, kind)
+    if df is not None:
+        return df
+
+    mtime = os.path.getmtime(dataset_path(student_id))
+    df = loader()
+    if _enabled:
+        size = int(df.memory_usage(deep=True).sum())
+        if size <= _limit:
+            _frames[(student_id, kind)] = (mtime, df, size)
+            _evict()
+        return df.copy(deep=False)
+    return df
@@ -0,0 +1,105 @@
+import os
+import json
+import contextlib
+import pickle
+import hashlib
+
+# Thư mục lưu kết quả của các bước xử lý
+CACHE_DIR = os.path.join('output', 'cache')
+
+# Tăng khi định dạng kết quả của các bước thay đổi để bỏ cache cũ
+CACHE_VERSION = 6
+
+# Dung lượng tối đa của thư mục cache (MB), có thể đổi qua biến môi trường
+CACHE_LIMIT_MB = int(os.environ.get('STAGE_CACHE_MB', 512))
+
+def file_hash(path):
+    """Tính SHA-256 nội dung file, ghi nhớ theo (kích thước, thời gian sửa) để khỏi đọc lại"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    index_file = os.path.join(CACHE_DIR, 'hashes.json')
+    try:
+        with open(index_file, encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+
+    stat = os.stat(path)
+    signature = [stat.st_size, stat.st_mtime_ns]
+    entry = index.get(os.path.abspath(path))
+    if entry and entry['signature'] == signature:
+        return entry['sha256']
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+
+    index[os.path.abspath(path)] = {'signature': signature, 'sha256': digest.hexdigest()}
+    tmp_file = f'{index_file}.{os.getpid()}.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp_file, index_file)
+    return digest.hexdigest()
+
+def cache_key(stage, input_file, params):
+    """Khóa cache từ nội dung file đầu vào, tên bước và tham số"""
+    payload = json.dumps({
+        'version': CACHE_VERSION,
+        'stage': stage,
+        'input': file_hash(input_file),
+        'params': params
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def evict(limit_mb=None, keep=None):
+    """Xóa các kết quả ít dùng nhất cho đến khi thư mục cache nằm trong giới hạn
+
+    File keep (kết quả vừa ghi) không bao giờ bị xóa.
+    """
+    limit = (limit_mb if limit_mb is not None else CACHE_LIMIT_MB) * 1024 * 1024
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith('.pkl'):
+            path = os.path.join(CACHE_DIR, name)
+            # Tiến trình khác (batch.py) có thể vừa xóa file này
+            with contextlib.suppress(FileNotFoundError):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if path == keep:
+            continue
+        if total <= limit:
+            break
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+        total -= size
+
+def cached_stage(stage, input_file, params, compute):
+    """Trả về kết quả đã lưu của một bước nếu file đầu vào và tham số không đổi
+
+    compute chỉ được gọi khi chưa có kết quả; kết quả mới được lưu lại và
+    thư mục cache được dọn theo thứ tự ít dùng gần đây nhất (LRU).
+    """
+    key = cache_key(stage, input_file, params)
+    cache_file = os.path.join(CACHE_DIR, f'{stage}_{key[:32]}.pkl')
+
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as f:
+                result = pickle.load(f)
+            os.utime(cache_file)  # Đánh dấu vừa dùng cho LRU
+            print(f"→ Dùng kết quả đã lưu: {cache_file}")
+            return result
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+
+    result = compute()
+
+    tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+    evict(keep=cache_file)
+    return result
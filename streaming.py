@@ -0,0 +1,396 @@
+import sys
+import os
+import csv
+import copy
+import json
+import time
+import queue
+import signal
+import argparse
+import threading
+import numpy as np
+from colorama import init, Fore, Style
+from datasets import dataset_path
+import kernels
+
+init()
+
+COLUMNS = ['customer_id', 'order_date', 'price', 'quantity', 'discount']
+
+class P2Quantile:
+    """Ước lượng phân vị trực tuyến bằng thuật toán P² (Jain & Chlamtac), bộ nhớ cố định"""
+
+    def __init__(self, q):
+        self.q = q
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5]
+        self.increments = [0, q / 2, q, (1 + q) / 2, 1]
+
+    def add(self, x):
+        heights = self.heights
+        if len(heights) < 5:
+            heights.append(x)
+            heights.sort()
+            return
+
+        # Tìm ô chứa x và cập nhật các mốc biên
+        if x < heights[0]:
+            heights[0] = x
+            k = 0
+        elif x >= heights[4]:
+            heights[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= heights[k + 1]:
+                k += 1
+
+        for i in range(k + 1, 5):
+            self.positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Điều chỉnh 3 mốc giữa về vị trí mong muốn
+        for i in range(1, 4):
+            d = self.desired[i] - self.positions[i]
+            if ((d >= 1 and self.positions[i + 1] - self.positions[i] > 1) or
+                    (d <= -1 and self.positions[i - 1] - self.positions[i] < -1)):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = self._linear(i, d)
+                heights[i] = height
+                self.positions[i] += d
+
+    def _parabolic(self, i, d):
+        n, h = self.positions, self.heights
+        return h[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+
+    def _linear(self, i, d):
+        n, h = self.positions, self.heights
+        return h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+
+    def value(self):
+        if not self.heights:
+            return float('nan')
+        if len(self.heights) < 5:
+            return float(np.quantile(self.heights, self.q))
+        return self.heights[2]
+
+    def to_dict(self):
+        return {'q': self.q, 'heights': self.heights, 'positions': self.positions,
+                'desired': self.desired}
+
+    @classmethod
+    def from_dict(cls, state):
+        estimator = cls(state['q'])
+        estimator.heights = state['heights']
+        estimator.positions = state['positions']
+        estimator.desired = state['desired']
+        return estimator
+
+class StreamingDetector:
+    """Duy trì ngưỡng Z-score, IQR và trung vị theo từng lô giao dịch đến"""
+
+    def __init__(self, threshold=3, multiplier=5, warmup=100):
+        self.threshold = threshold
+        self.multiplier = multiplier
+        self.warmup = warmup
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.quantiles = {q: P2Quantile(q) for q in (0.25, 0.5, 0.75)}
+
+    def thresholds(self):
+        """Các ngưỡng hiện tại"""
+        std = np.sqrt(self.m2 / self.count) if self.count else 0.0
+        q1, median, q3 = (self.quantiles[q].value() for q in (0.25, 0.5, 0.75))
+        iqr = q3 - q1
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'std': std,
+            'iqr_lower': q1 - 1.5 * iqr,
+            'iqr_upper': q3 + 1.5 * iqr,
+            'median_threshold': median * self.multiplier
+        }
+
+    def process(self, amounts):
+        """Đánh dấu bất thường theo ngưỡng hiện tại rồi cập nhật ngưỡng bằng lô mới
+
+        Lô vượt qua mốc khởi động (warmup) được tách tại mốc đó: phần đầu chỉ
+        dùng để tạo ngưỡng, phần còn lại được đánh dấu theo ngưỡng vừa tạo.
+        """
+        head = self.warmup - self.count
+        if 0 < head < len(amounts):
+            flags = self.process(amounts[:head])
+            rest = self.process(amounts[head:])
+            return {name: np.concatenate([flags[name], rest[name]]) for name in flags}
+
+        limits = self.thresholds()
+        if self.count >= self.warmup:
+            z = np.abs(amounts - limits['mean']) / limits['std'] if limits['std'] > 0 else np.zeros(len(amounts))
+            flags = {
+                'Z-score': z > self.threshold,
+                'IQR': (amounts < limits['iqr_lower']) | (amounts > limits['iqr_upper']),
+                'Median': amounts > limits['median_threshold']
+            }
+        else:
+            flags = {name: np.zeros(len(amounts), dtype=bool) for name in ('Z-score', 'IQR', 'Median')}
+
+        # Gộp lô mới vào trung bình/phương sai (công thức Chan)
+        n = len(amounts)
+        if n:
+            batch_mean = amounts.mean()
+            batch_m2 = ((amounts - batch_mean) ** 2).sum()
+            total = self.count + n
+            delta = batch_mean - self.mean
+            self.mean += delta * n / total
+            self.m2 += batch_m2 + delta ** 2 * self.count * n / total
+            self.count = total
+            for estimator in self.quantiles.values():
+                for x in amounts.tolist():
+                    estimator.add(x)
+        return flags
+
+    def to_dict(self):
+        return {'threshold': self.threshold, 'multiplier': self.multiplier, 'warmup': self.warmup,
+                'count': self.count, 'mean': self.mean, 'm2': self.m2,
+                'quantiles': [e.to_dict() for e in self.quantiles.values()]}
+
+    @classmethod
+    def from_dict(cls, state):
+        detector = cls(state['threshold'], state['multiplier'], state['warmup'])
+        detector.count = state['count']
+        detector.mean = state['mean']
+        detector.m2 = state['m2']
+        for entry in state['quantiles']:
+            detector.quantiles[entry['q']] = P2Quantile.from_dict(entry)
+        return detector
+
+def parse_rows(lines, positions):
+    """Đọc các dòng CSV thành mảng, bỏ qua dòng thiếu hoặc sai giá trị"""
+    records = []
+    for row in csv.reader(lines):
+        try:
+            record = [row[positions[c]] for c in COLUMNS]
+            price, quantity, discount = float(record[2]), int(record[3]), float(record[4])
+        except (IndexError, ValueError):
+            continue
+        if np.isnan(price) or np.isnan(discount):
+            continue
+        records.append((record[0], record[1], price, quantity, discount))
+    return records
+
+def _stdin_reader(lines):
+    """Luồng đọc stdin, đẩy từng dòng vào hàng đợi (None khi hết dữ liệu)"""
+    for line in sys.stdin:
+        lines.put(line)
+    lines.put(None)
+
+def stream_anomalies(student_id, source=None, threshold=3, multiplier=5, poll_interval=0.2,
+                     batch_size=10_000, checkpoint_interval=30, follow=True):
+    """Theo dõi file giao dịch đang ghi thêm (hoặc stdin nếu source là '-') và
+    ghi các giao dịch đáng ngờ trong vòng poll_interval giây kể từ khi đến.
+
+    Ngưỡng và vị trí đọc được lưu định kỳ vào file checkpoint để có thể chạy
+    lại mà không cần đọc lại toàn bộ lịch sử. Checkpoint cũng được lưu ngay sau
+    mỗi lô có giao dịch đáng ngờ, kèm kích thước file kết quả: khi chạy lại, các
+    dòng ghi sau checkpoint cuối (sẽ được đánh dấu lại) bị cắt khỏi file kết quả.
+
+    Checkpoint chỉ chứa trạng thái sau lô đã xử lý xong (vị trí đọc, ngưỡng,
+    kích thước file kết quả), nên dừng giữa chừng (Ctrl-C, SIGTERM) không làm
+    mất hay tính hai lần các dòng của lô đang xử lý.
+    """
+    print(f"\n{Fore.GREEN}Bắt đầu phát hiện bất thường theo luồng...{Style.RESET_ALL}")
+    print("=" * 50)
+
+    source = source or dataset_path(student_id)
+    checkpoint_file = os.path.join('output', f'stream_checkpoint_{student_id}.json')
+    output_file = os.path.join('output', f'stream_suspects_{student_id}.csv')
+
+    # Khôi phục ngưỡng và vị trí đọc từ checkpoint
+    offset = None
+    if os.path.exists(checkpoint_file):
+        with open(checkpoint_file, encoding='utf-8') as f:
+            state = json.load(f)
+        detector = StreamingDetector.from_dict(state['detector'])
+        if state.get('source') == source:
+            offset = state.get('offset')
+        print(f"→ Khôi phục checkpoint: {detector.count:,} giao dịch đã xử lý")
+        # Bỏ các dòng kết quả ghi sau checkpoint: các giao dịch đó sẽ được xử lý lại
+        output_size = state.get('output_size')
+        if output_size is not None and os.path.exists(output_file) and \
+                os.path.getsize(output_file) > output_size:
+            with open(output_file, 'r+b') as f:
+                f.truncate(output_size)
+            print("→ Bỏ các dòng kết quả ghi sau checkpoint cuối")
+        # Ngưỡng trên dòng lệnh luôn được áp dụng, kể cả khi khác giá trị trong checkpoint
+        if (detector.threshold, detector.multiplier) != (threshold, multiplier):
+            print(f"{Fore.YELLOW}→ Dùng ngưỡng mới: threshold {detector.threshold} → {threshold}, "
+                  f"multiplier {detector.multiplier} → {multiplier}{Style.RESET_ALL}")
+            detector.threshold = threshold
+            detector.multiplier = multiplier
+    else:
+        detector = StreamingDetector(threshold, multiplier)
+
+    def commit():
+        """Trạng thái sau lô vừa xử lý xong (tạo đủ rồi mới gán một lần)"""
+        out.flush()
+        return {'offset': offset, 'output_size': os.fstat(out.fileno()).st_size,
+                'detector': copy.deepcopy(detector.to_dict()), 'flagged': total_flagged}
+
+    def save_checkpoint():
+        tmp_file = checkpoint_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'source': source, 'offset': committed['offset'], 'saved_at': time.time(),
+                       'output_size': committed['output_size'],
+                       'detector': committed['detector']}, f)
+        os.replace(tmp_file, checkpoint_file)
+
+    new_output = not os.path.exists(output_file)
+    out = open(output_file, 'a', newline='', encoding='utf-8')
+    writer = csv.writer(out)
+    if new_output:
+        writer.writerow(COLUMNS + ['total_amount', 'detection_method', 'detected_at'])
+        out.flush()
+
+    print(f"→ Nguồn dữ liệu: {'stdin' if source == '-' else source}")
+    print(f"→ Kết quả: {output_file}")
+    print(f"→ Checkpoint: {checkpoint_file}")
+
+    # Nguồn dữ liệu: stdin qua luồng đọc riêng, hoặc file đọc tiếp từ vị trí đã lưu
+    if source == '-':
+        lines = queue.Queue()
+        threading.Thread(target=_stdin_reader, args=(lines,), daemon=True).start()
+        header = lines.get()
+        stream = None
+    else:
+        stream = open(source, encoding='utf-8', newline='')
+        header = stream.readline()
+    positions = {name: i for i, name in enumerate(next(csv.reader([header or ''])))}
+    has_header = all(c in positions for c in COLUMNS)
+    if not has_header:
+        # Không có tiêu đề: dòng đầu tiên là một giao dịch, đưa lại vào lô đầu tiên
+        positions = {name: i for i, name in enumerate(COLUMNS)}
+    pending = [header] if stream is None and header and not has_header else []
+    if stream is not None:
+        stream.seek(offset or (stream.tell() if has_header else 0))
+        offset = stream.tell()
+
+    total_flagged = 0
+    committed = commit()
+    last_checkpoint = time.monotonic()
+    # stdin rỗng: lines.get() ở trên đã lấy luôn dấu kết thúc None
+    finished = stream is None and header is None
+    try:
+        while not finished:
+            # 1. Lấy các dòng đã có sẵn (tối đa batch_size)
+            batch, pending = pending, []
+            if stream is None:
+                try:
+                    line = lines.get(timeout=poll_interval)
+                    while line is not None:
+                        batch.append(line)
+                        if len(batch) >= batch_size:
+                            break
+                        line = lines.get_nowait()
+                    else:
+                        finished = True
+                except queue.Empty:
+                    pass
+            else:
+                while len(batch) < batch_size:
+                    position = stream.tell()
+                    line = stream.readline()
+                    if not line.endswith('\n'):
+                        # Dòng chưa ghi xong: đọc lại ở vòng sau
+                        stream.seek(position)
+                        break
+                    batch.append(line)
+                offset = stream.tell()
+                if not batch:
+                    if not follow:
+                        finished = True
+                    elif os.path.getsize(source) < offset:
+                        print(f"{Fore.YELLOW}→ File bị ghi đè, đọc lại từ đầu{Style.RESET_ALL}")
+                        stream.seek(0)
+                        if has_header:
+                            stream.readline()
+                        offset = stream.tell()
+                    else:
+                        time.sleep(poll_interval)
+
+            # 2. Đánh dấu bất thường và ghi ngay ra file kết quả
+            records = parse_rows(batch, positions)
+            if records:
+                quantity = np.array([r[3] for r in records], dtype=np.float64)
+                price = np.array([r[2] for r in records])
+                discount = np.array([r[4] for r in records])
+                amounts = kernels.total_amount(quantity, price, discount)
+
+                flags = detector.process(amounts)
+                detected_at = time.strftime('%Y-%m-%d %H:%M:%S')
+                suspect = np.zeros(len(records), dtype=bool)
+                for method in flags.values():
+                    suspect |= method
+                for i in np.flatnonzero(suspect):
+                    methods = '|'.join(name for name, mask in flags.items() if mask[i])
+                    writer.writerow(list(records[i]) + [amounts[i], methods, detected_at])
+                total_flagged += int(suspect.sum())
+                if suspect.any():
+                    print(f"→ {detector.count:,} giao dịch, {total_flagged:,} đáng ngờ")
+
+            # 3. Lô đã xử lý xong: lưu checkpoint cùng lô có giao dịch đáng ngờ, còn lại thì định kỳ
+            committed = commit()
+            if (records and suspect.any()) or time.monotonic() - last_checkpoint >= checkpoint_interval:
+                save_checkpoint()
+                last_checkpoint = time.monotonic()
+    except KeyboardInterrupt:
+        print(f"\n{Fore.YELLOW}Đã dừng theo dõi.{Style.RESET_ALL}")
+    finally:
+        # Bỏ phần lô đang xử lý dở: quay về trạng thái của lô cuối đã xử lý xong
+        detector = StreamingDetector.from_dict(copy.deepcopy(committed['detector']))
+        total_flagged = committed['flagged']
+        save_checkpoint()
+        out.close()
+        if stream is not None:
+            stream.close()
+
+    limits = detector.thresholds()
+    print(f"\n{Fore.GREEN}Tổng kết:{Style.RESET_ALL}")
+    print(f"→ Số giao dịch đã xử lý: {detector.count:,}")
+    print(f"→ Số giao dịch đáng ngờ: {total_flagged:,}")
+    print(f"→ Ngưỡng Z-score: ${limits['mean']:.2f} ± {detector.threshold} × ${limits['std']:.2f}")
+    print(f"→ Khoảng IQR: ${limits['iqr_lower']:.2f} - ${limits['iqr_upper']:.2f}")
+    print(f"→ Ngưỡng trung vị: ${limits['median_threshold']:.2f}")
+
+    print("\n" + "=" * 50)
+    print(f"{Fore.GREEN}Hoàn thành phát hiện bất thường theo luồng!{Style.RESET_ALL}")
+
+    return detector
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Phát hiện giao dịch bất thường theo luồng")
+    parser.add_argument('student_id')
+    parser.add_argument('--source', default=None,
+                        help="File giao dịch cần theo dõi, '-' để đọc từ stdin "
+                             "(mặc định: output/transactions_<student_id>.csv)")
+    parser.add_argument('--threshold', type=float, default=3)
+    parser.add_argument('--multiplier', type=float, default=5)
+    parser.add_argument('--poll', type=float, default=0.2,
+                        help="Độ trễ tối đa (giây) khi chờ dữ liệu mới")
+    parser.add_argument('--checkpoint', type=float, default=30,
+                        help="Chu kỳ lưu checkpoint (giây)")
+    parser.add_argument('--no-follow', action='store_true',
+                        help="Dừng khi đọc hết file thay vì chờ dữ liệu mới")
+    args = parser.parse_args()
+
+    # Dừng bằng SIGTERM vẫn lưu checkpoint
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    stream_anomalies(args.student_id, args.source, args.threshold, args.multiplier,
+                     args.poll, checkpoint_interval=args.checkpoint, follow=not args.no_follow)